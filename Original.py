@@ -1,14 +1,27 @@
+import argparse
+import glob
+import itertools
+import json
+import queue
 import cv2
 import mediapipe as mp
 import numpy as np
-import winsound
 import threading
 import os
 import time
-from PIL import Image, ImageDraw, ImageFont
+from concurrent.futures import ThreadPoolExecutor
+from emoji_sprites import get_sprite_cache
+from frame_arena import FrameArena
+
+try:
+    import winsound
+except ImportError:  # not Windows, sounds are only logged
+    winsound = None
+
+SOUNDS_DIR = os.environ.get('SOUNDS_DIR', 'C:/Users/dsrus/Desktop/Workspace/4elements/Sounds')
 
 class ElementGame:
-    def __init__(self, cap, width, height):
+    def __init__(self, cap, width, height, parallel_inference=True, play_sounds=True, record_events=False):
         self.cap = cap
         self.width = width
         self.height = height
@@ -22,22 +35,27 @@ class ElementGame:
         self.mp_selfie_segmentation = mp.solutions.selfie_segmentation
         self.selfie_segmentation = self.mp_selfie_segmentation.SelfieSegmentation(model_selection=0)
         
+        # Segmentation runs on this thread while hand tracking runs on the caller's
+        self.executor = ThreadPoolExecutor(max_workers=1) if parallel_inference else None
+        self.stage_timings = {}
+        
         # Initialize drawing utilities
         self.mp_drawing = mp.solutions.drawing_utils
         
         self.squares = {
-            '🔥': {'color': (255, 0, 0), 'position': (0, 0), 'sound': 'C:/Users/dsrus/Desktop/Workspace/4elements/Sounds/fireplace-6160.wav'},
-            '💨': {'color': (0, 215, 255), 'position': (width - self.square_size, 0), 'sound': 'C:/Users/dsrus/Desktop/Workspace/4elements/Sounds/air.wav'},
-            '🌊': {'color': (0, 0, 255), 'position': (0, height - self.square_size), 'sound': 'C:/Users/dsrus/Desktop/Workspace/4elements/Sounds/water.wav'},
-            '🌱': {'color': (0, 128, 128), 'position': (width - self.square_size, height - self.square_size), 'sound': 'C:/Users/dsrus/Desktop/Workspace/4elements/Sounds/earth.wav'}
+            '🔥': {'color': (255, 0, 0), 'position': (0, 0), 'sound': os.path.join(SOUNDS_DIR, 'fireplace-6160.wav')},
+            '💨': {'color': (0, 215, 255), 'position': (width - self.square_size, 0), 'sound': os.path.join(SOUNDS_DIR, 'air.wav')},
+            '🌊': {'color': (0, 0, 255), 'position': (0, height - self.square_size), 'sound': os.path.join(SOUNDS_DIR, 'water.wav')},
+            '🌱': {'color': (0, 128, 128), 'position': (width - self.square_size, height - self.square_size), 'sound': os.path.join(SOUNDS_DIR, 'earth.wav')}
         }
         
         self.gold_box = {'color': (255, 255, 0), 'position': ((width - self.square_size) // 2, height - self.square_size)}
-        self.eureka_sound = 'C:/Users/dsrus/Desktop/Workspace/4elements/Sounds/Eureka.wav'
+        self.eureka_sound = os.path.join(SOUNDS_DIR, 'Eureka.wav')
         
         self.sound_played = {element: False for element in self.squares}
         self.finger_in_box = {element: False for element in self.squares}
-        self.last_sound_time = {element: 0 for element in self.squares}
+        # Headless cooldowns run on video time, which starts at 0, so the first touch must not look recent
+        self.last_sound_time = {element: float('-inf') for element in self.squares}
         
         self.grabbed_word = None
         self.gold_achieved = False
@@ -45,8 +63,18 @@ class ElementGame:
         
         self.current_sound = None
         self.fire_sound_playing = False
+        self.play_sounds = play_sounds and winsound is not None
+        
+        # Gesture and sound events for the headless log, stamped with the frame being composed
+        self.events = [] if record_events else None
+        self.frame_index = None
+        self.current_time = None
+        
+        self.emoji_sprites = get_sprite_cache(tuple(self.squares))
         
-        self.emoji_font = ImageFont.truetype("seguiemj.ttf", 48)
+        # Scratch buffers for the compose stage, which runs one frame at a time
+        self.arena = FrameArena()
+        self.mask_plane_color = None
         
         self.reset_word_positions()
 
@@ -67,7 +95,16 @@ class ElementGame:
         return (box_position[0] < point[0] < box_position[0] + box_size and
                 box_position[1] < point[1] < box_position[1] + box_size)
 
+    def record_event(self, event, **details):
+        if self.events is not None:
+            self.events.append({'event': event, 'frame': self.frame_index,
+                                'time': round(self.current_time, 3), **details})
+
     def play_sound(self, sound_file):
+        self.record_event('sound', sound=os.path.basename(sound_file))
+        if not self.play_sounds:
+            return
+
         def play():
             try:
                 if not os.path.exists(sound_file):
@@ -89,29 +126,61 @@ class ElementGame:
         threading.Thread(target=play, daemon=True).start()
 
     def stop_fire_sound(self):
-        if self.fire_sound_playing:
+        if self.fire_sound_playing and winsound is not None:
             winsound.PlaySound(None, winsound.SND_PURGE)
             self.fire_sound_playing = False
             self.current_sound = None
 
-    def apply_mask(self, image_rgb):
-        results = self.selfie_segmentation.process(image_rgb)
-        condition = np.stack((results.segmentation_mask,) * 3, axis=-1) > 0.1
+    def segment(self, image_rgb):
+        start = time.perf_counter()
+        segmentation_mask = self.selfie_segmentation.process(image_rgb).segmentation_mask
+        self.stage_timings['segmentation'] = (time.perf_counter() - start) * 1000
+        return segmentation_mask
+
+    def apply_mask(self, image_rgb, segmentation_mask=None):
+        if segmentation_mask is None:
+            segmentation_mask = self.segment(image_rgb)
         if self.mask_color is not None:
-            overlay = np.zeros(image_rgb.shape, dtype=np.uint8)
-            overlay[:] = self.mask_color
-            overlay = cv2.addWeighted(image_rgb, 0.8, overlay, 0.2, 0)
-            image_rgb = np.where(condition, overlay, image_rgb)
+            # Tint the person in place; the single-channel condition broadcasts over RGB
+            condition = np.greater(segmentation_mask, 0.1,
+                                   out=self.arena.get('condition', segmentation_mask.shape, bool))
+            color_plane = self.arena.get('mask_color_plane', image_rgb.shape)
+            if self.mask_plane_color != self.mask_color:
+                color_plane[:] = self.mask_color
+                self.mask_plane_color = self.mask_color
+            tinted = cv2.addWeighted(image_rgb, 0.8, color_plane, 0.2, 0,
+                                     dst=self.arena.get('mask_tinted', image_rgb.shape))
+            np.copyto(image_rgb, tinted, where=condition[..., None])
         return image_rgb
 
     def process_frame(self, frame):
-        image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return self.compose(*self.infer(frame))
+
+    def infer(self, frame):
+        # Model stage: BGR frame in, RGB frame plus hand results and segmentation mask out.
+        # The frame is converted in place and becomes the returned image.
+        image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+
+        # Hand tracking and segmentation are independent, so run them side by side
+        start = time.perf_counter()
+        segmentation = self.executor.submit(self.segment, image_rgb) if self.executor else None
+        hands_start = time.perf_counter()
         results = self.hands.process(image_rgb)
+        self.stage_timings['hands'] = (time.perf_counter() - hands_start) * 1000
+        segmentation_mask = segmentation.result() if segmentation else self.segment(image_rgb)
+        self.stage_timings['inference'] = (time.perf_counter() - start) * 1000
+        return image_rgb, results, segmentation_mask
+
+    def compose(self, image_rgb, results, segmentation_mask, frame_index=None, timestamp=None):
+        # Game logic and drawing stage. Batch runs pass the video time so cooldowns are reproducible.
+        self.frame_index = frame_index
+        self.current_time = time.time() if timestamp is None else timestamp
 
         # Apply mask first
-        image_rgb = self.apply_mask(image_rgb)
+        image_rgb = self.apply_mask(image_rgb, segmentation_mask)
 
-        overlay = image_rgb.copy()
+        overlay = self.arena.get('overlay', image_rgb.shape)
+        np.copyto(overlay, image_rgb)
         for element, info in self.squares.items():
             cv2.rectangle(overlay, info['position'], 
                           (info['position'][0] + self.square_size, info['position'][1] + self.square_size), 
@@ -123,8 +192,6 @@ class ElementGame:
                       self.gold_box['color'], -1)
         cv2.addWeighted(overlay, 0.25, image_rgb, 0.75, 0, image_rgb)
 
-        pil_image = Image.fromarray(image_rgb)
-
         if results.multi_hand_landmarks:
             for hand_landmarks in results.multi_hand_landmarks:
                 self.mp_drawing.draw_landmarks(
@@ -142,7 +209,9 @@ class ElementGame:
                     if hand_closed:
                         self.word_positions[self.grabbed_word] = (x, y)
                     else:
-                        if self.is_point_in_box((x, y), self.gold_box['position'], self.square_size):
+                        in_gold_box = self.is_point_in_box((x, y), self.gold_box['position'], self.square_size)
+                        self.record_event('drop', element=self.grabbed_word, position=[x, y], in_gold_box=in_gold_box)
+                        if in_gold_box:
                             self.mask_color = self.squares[self.grabbed_word]['color']
                             if self.grabbed_word == '🔥':
                                 self.play_sound(self.squares['🔥']['sound'])
@@ -154,6 +223,7 @@ class ElementGame:
                                                  if self.is_point_in_box(pos, self.gold_box['position'], self.square_size))
                             if emojis_in_gold == 4:
                                 self.gold_achieved = True
+                                self.record_event('gold')
                                 self.gold_box['color'] = (255, 255, 0)  # Gold color
                                 self.play_sound(self.eureka_sound)
                             else:
@@ -162,9 +232,10 @@ class ElementGame:
                 else:
                     for element, info in self.squares.items():
                         if self.is_point_in_box((x, y), info['position'], self.square_size):
-                            current_time = time.time()
+                            current_time = self.current_time
                             if not self.finger_in_box[element]:
                                 print(f"Touch detected in {element} square")
+                                self.record_event('touch', element=element)
                                 self.finger_in_box[element] = True
                                 if current_time - self.last_sound_time[element] > 1:  # 1 second cooldown
                                     print(f"Attempting to play sound for {element}")
@@ -173,14 +244,14 @@ class ElementGame:
                                     self.last_sound_time[element] = current_time
                             if hand_closed and not self.grabbed_word:
                                 self.grabbed_word = element
+                                self.record_event('grab', element=element)
                         else:
                             self.finger_in_box[element] = False
 
-        for element, position in self.word_positions.items():
-            draw = ImageDraw.Draw(pil_image)
-            draw.text((position[0], position[1]), element, font=self.emoji_font, fill=(255, 255, 255), anchor="mm")
+        self.emoji_sprites.draw(image_rgb, self.word_positions,
+                                self.arena.get('emoji_scratch', self.emoji_sprites.max_tile_shape, np.uint16))
 
-        return np.array(pil_image)
+        return image_rgb
 
 class CameraManager:
     def __init__(self, cap):
@@ -213,7 +284,7 @@ class MainProgram:
             else:
                 image_rgb = self.game.apply_mask(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
 
-            image_bgr = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
+            image_bgr = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR, dst=image_rgb)
             cv2.imshow('Camera View', image_bgr)
 
             key = cv2.waitKey(1) & 0xFF
@@ -226,10 +297,203 @@ class MainProgram:
                 self.camera_manager.switch_view()
 
         self.game.stop_fire_sound()
+        if self.game.executor:
+            self.game.executor.shutdown()
         self.cap.release()
         cv2.destroyAllWindows()
-        winsound.PlaySound(None, winsound.SND_PURGE)
+        if winsound is not None:
+            winsound.PlaySound(None, winsound.SND_PURGE)
+
+class HeadlessProgram:
+    # Offline runs without a camera or window: frames from a video file or an image directory go
+    # through decode -> inference -> compose -> encode threads joined by bounded queues, so each
+    # stage works on a different frame at once. Writes an annotated video and a JSON event log.
+    STAGES = ('decode', 'inference', 'compose', 'encode')
+
+    def __init__(self, source, output, events_path=None, flip=False, queue_size=8, fps=None,
+                 fourcc='mp4v', play_sounds=False):
+        self.source = source
+        self.output = output
+        self.events_path = events_path
+        self.flip = flip
+        self.queue_size = max(1, queue_size)
+        self.fourcc = fourcc
+        self.play_sounds = play_sounds
+
+        if os.path.isdir(source):
+            self.files = sorted(path for pattern in ('*.jpg', '*.jpeg', '*.png')
+                                for path in glob.glob(os.path.join(source, pattern)))
+            first = cv2.imread(self.files[0]) if self.files else None
+            self.fps = fps or 30.0
+        else:
+            self.files = None
+            cap = cv2.VideoCapture(source)
+            ok, first = cap.read()
+            self.fps = fps or cap.get(cv2.CAP_PROP_FPS) or 30.0
+            cap.release()
+        if first is None:
+            raise ValueError(f"No frames could be read from {source}")
+        self.height, self.width = first.shape[:2]
+
+        self.stage_seconds = {stage: 0.0 for stage in self.STAGES}
+        self.error = None
+        self._failed = threading.Event()
+
+    def frames(self):
+        if self.files is not None:
+            for path in self.files:
+                frame = cv2.imread(path)
+                if frame is None:
+                    print(f"Skipping unreadable image: {path}")
+                    continue
+                if frame.shape[:2] != (self.height, self.width):
+                    frame = cv2.resize(frame, (self.width, self.height))
+                yield frame
+        else:
+            cap = cv2.VideoCapture(self.source)
+            try:
+                while True:
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    yield frame
+            finally:
+                cap.release()
+
+    def _put(self, stage_queue, item):
+        # Waits for room downstream, but gives up once another stage has failed
+        while not self._failed.is_set():
+            try:
+                stage_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, stage_queue):
+        while not self._failed.is_set():
+            try:
+                return stage_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _decode(self, outbox):
+        try:
+            frames = self.frames()
+            for index in itertools.count():
+                start = time.perf_counter()
+                frame = next(frames, None)
+                if frame is None:
+                    break
+                if self.flip:
+                    frame = cv2.flip(frame, 1)
+                self.stage_seconds['decode'] += time.perf_counter() - start
+                if not self._put(outbox, (index, frame)):
+                    return
+        except Exception as e:
+            self.error = f"decode stage failed: {e}"
+            print(self.error)
+            self._failed.set()
+        finally:
+            self._put(outbox, None)
+
+    def _stage(self, name, work, inbox, outbox):
+        # Runs work(item) for every item until the end marker (None), then passes the marker on
+        try:
+            while True:
+                item = self._get(inbox)
+                if item is None:
+                    break
+                start = time.perf_counter()
+                result = work(item)
+                self.stage_seconds[name] += time.perf_counter() - start
+                if outbox is not None and not self._put(outbox, result):
+                    return
+        except Exception as e:
+            self.error = f"{name} stage failed: {e}"
+            print(self.error)
+            self._failed.set()
+        finally:
+            if outbox is not None:
+                self._put(outbox, None)
+
+    def run(self):
+        game = ElementGame(None, self.width, self.height, play_sounds=self.play_sounds, record_events=True)
+        writer = cv2.VideoWriter(self.output, cv2.VideoWriter_fourcc(*self.fourcc), self.fps,
+                                 (self.width, self.height))
+        if not writer.isOpened():
+            raise ValueError(f"Could not open {self.output} for writing")
+        decoded, inferred, composed = (queue.Queue(maxsize=self.queue_size) for _ in range(3))
+        written = 0
+
+        def infer(item):
+            index, frame = item
+            return (index,) + game.infer(frame)
+
+        def compose(item):
+            index, image_rgb, results, segmentation_mask = item
+            return index, game.compose(image_rgb, results, segmentation_mask, index, index / self.fps)
+
+        def encode(item):
+            nonlocal written
+            index, image_rgb = item
+            writer.write(cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR, dst=image_rgb))
+            written += 1
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._decode, args=(decoded,), name='headless-decode', daemon=True)]
+        threads += [threading.Thread(target=self._stage, args=args, name=f'headless-{args[0]}', daemon=True)
+                    for args in (('inference', infer, decoded, inferred), ('compose', compose, inferred, composed))]
+        for thread in threads:
+            thread.start()
+        # Encoding runs here, it owns the writer
+        self._stage('encode', encode, composed, None)
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        writer.release()
+        game.stop_fire_sound()
+        if game.executor:
+            game.executor.shutdown()
+
+        report = {
+            'source': self.source,
+            'output': self.output,
+            'frames': written,
+            'fps': self.fps,
+            'elapsed_seconds': round(elapsed, 3),
+            'throughput_fps': round(written / elapsed, 2) if elapsed else None,
+            'stage_ms_per_frame': {stage: round(seconds * 1000 / written, 2) if written else None
+                                   for stage, seconds in self.stage_seconds.items()},
+            'error': self.error,
+            'events': game.events
+        }
+        if self.events_path:
+            with open(self.events_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Wrote {written} frames to {self.output} in {elapsed:.1f}s ({report['throughput_fps']} fps), "
+              f"{len(game.events)} events")
+        return report
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="4 Elements game: live camera, or headless over a video/images")
+    parser.add_argument('--input', help="Video file or image directory to process headless instead of the camera")
+    parser.add_argument('--output', default='output.mp4', help="Annotated video written in headless mode")
+    parser.add_argument('--events', help="JSON log of gesture and sound events (headless mode)")
+    parser.add_argument('--flip', action='store_true', help="Mirror frames like the live camera view")
+    parser.add_argument('--queue-size', type=int, default=8, help="Frames buffered between pipeline stages")
+    parser.add_argument('--fps', type=float, help="Output frame rate (default: the source's, or 30)")
+    parser.add_argument('--fourcc', default='mp4v', help="Output video codec")
+    parser.add_argument('--sounds', action='store_true', help="Also play sounds in headless mode (Windows)")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    program = MainProgram()
-    program.run()
\ No newline at end of file
+    args = parse_args()
+    if args.input:
+        HeadlessProgram(args.input, args.output, args.events, args.flip, args.queue_size, args.fps,
+                        args.fourcc, args.sounds).run()
+    else:
+        program = MainProgram()
+        program.run()
\ No newline at end of file
@@ -1,37 +1,673 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, g
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
 import cv2
 import mediapipe as mp
 import numpy as np
 import base64
-import io
+import json
 import logging
-from PIL import Image, ImageDraw, ImageFont
 import time
 import os
+import re
+import threading
+import uuid
+from emoji_sprites import get_sprite_cache
+from frame_arena import FrameArena
+from frame_codec import available_codecs, get_codec
+from scheduler import DROPPED_FRAMES_TOTAL, FrameScheduler, FrameSkipped, LatestFrameSlot, SessionRejected
+from state_store import create_store
+from worker_status import WorkerStatusBoard
+from metrics import (REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, Counter, Gauge, Histogram,
+                     MultiProcessCollector, SamplingProfiler)
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 
-logging.basicConfig(level=logging.WARNING)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING').upper())
 logger = logging.getLogger(__name__)
 
-class WebElementGame:
-    def __init__(self):
-        self.width = 640  # Standard webcam width
-        self.height = 480  # Standard webcam height
-        self.square_size = min(self.width, self.height) // 4
-        
+# Serving configuration
+PIPELINE_POOL_SIZE = int(os.environ.get('PIPELINE_POOL_SIZE', os.cpu_count() or 1))
+PIPELINE_CHECKOUT_TIMEOUT = float(os.environ.get('PIPELINE_CHECKOUT_TIMEOUT', 5.0))
+# Image codec backend (auto, opencv, pil, turbojpeg) and output format (jpeg, webp)
+FRAME_CODEC = os.environ.get('FRAME_CODEC', 'auto')
+FRAME_OUTPUT_FORMAT = os.environ.get('FRAME_OUTPUT_FORMAT', 'jpeg')
+# Run hand tracking and segmentation side by side (MediaPipe releases the GIL)
+PARALLEL_INFERENCE = os.environ.get('PARALLEL_INFERENCE', '1') == '1'
+MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 64))
+SESSION_IDLE_TIMEOUT = float(os.environ.get('SESSION_IDLE_TIMEOUT', 300))
+SESSION_MEMORY_CAP_MB = float(os.environ.get('SESSION_MEMORY_CAP_MB', 256))
+SESSION_COOKIE = 'elements_session'
+# Where per-session game state lives: memory://, shm:///dev/shm/elements-state or redis://host:port/0.
+# Anything but memory:// lets several worker processes serve the same session.
+STATE_STORE = os.environ.get('STATE_STORE', 'memory://')
+STATE_STORE_SWEEP_INTERVAL = 60
+
+# Fair scheduling in front of the pipeline pool: each session queues at most SCHEDULER_QUEUE_DEPTH
+# frames, sessions take turns for the pipelines, and frames older than FRAME_DEADLINE_MS are skipped.
+# New sessions are turned away while SCHEDULER_MAX_ACTIVE_SESSIONS (0: four per pipeline) are active;
+# a session that has state in STATE_STORE is already playing, possibly on another worker, and is let in.
+SCHEDULER_QUEUE_DEPTH = int(os.environ.get('SCHEDULER_QUEUE_DEPTH', 2))
+FRAME_DEADLINE_MS = float(os.environ.get('FRAME_DEADLINE_MS', 500))
+SCHEDULER_MAX_ACTIVE_SESSIONS = int(os.environ.get('SCHEDULER_MAX_ACTIVE_SESSIONS', 0))
+SCHEDULER_ACTIVE_WINDOW = float(os.environ.get('SCHEDULER_ACTIVE_WINDOW', 10))
+SESSION_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Segmentation runs at a reduced scale and is refreshed every N frames,
+# or sooner when the frame changes by more than the motion threshold
+SEGMENTATION_SCALE = float(os.environ.get('SEGMENTATION_SCALE', 0.5))
+SEGMENTATION_REFRESH_FRAMES = int(os.environ.get('SEGMENTATION_REFRESH_FRAMES', 5))
+SEGMENTATION_MOTION_THRESHOLD = float(os.environ.get('SEGMENTATION_MOTION_THRESHOLD', 6.0))
+MOTION_PROBE_SIZE = (32, 24)
+
+# Hand tracking is skipped on frames where nothing moved more than the threshold (mean grey-level
+# change, globally or around the last landmarks); the previous landmarks are reused for at most
+# HAND_REUSE_MAX_FRAMES frames in a row so grabs and drops never act on stale positions for long
+HAND_MOTION_GATE = os.environ.get('HAND_MOTION_GATE', '1') == '1'
+HAND_MOTION_THRESHOLD = float(os.environ.get('HAND_MOTION_THRESHOLD', 2.0))
+HAND_REUSE_MAX_FRAMES = int(os.environ.get('HAND_REUSE_MAX_FRAMES', 2))
+HAND_MOTION_PROBE_SIZE = (64, 48)
+HAND_MOTION_PADDING = 4  # probe pixels around the last landmarks
+
+# ROI tracking: after a confident detection the hand model only sees a padded crop around the
+# last hands, with a full-frame pass every HAND_ROI_FULL_FRAME_INTERVAL frames or when the crop loses them.
+# This is a resolution option, not a compute saving: the models run at fixed input sizes, so a crop
+# pass costs about as much as a full-frame one, but small or distant hands fill more of the
+# detector's input and the crop comes from the full-resolution frame even when inference is scaled.
+HAND_ROI = os.environ.get('HAND_ROI', '0') == '1'
+HAND_ROI_PADDING = float(os.environ.get('HAND_ROI_PADDING', 0.5))  # of the hand box size, per side
+HAND_ROI_FULL_FRAME_INTERVAL = int(os.environ.get('HAND_ROI_FULL_FRAME_INTERVAL', 10))
+HAND_ROI_MIN_SCORE = 0.8
+HAND_ROI_MIN_SIZE = 96  # pixels
+HAND_ROI_MAX_AREA = 0.5  # larger crops gain too little resolution, run on the full frame instead
+
+# Adaptive quality: each session steps through QUALITY_LEVELS (best first) to hold TARGET_FPS
+ADAPTIVE_QUALITY = os.environ.get('ADAPTIVE_QUALITY', '1') == '1'
+TARGET_FPS = float(os.environ.get('TARGET_FPS', 15))
+QUALITY_COOLDOWN_FRAMES = int(os.environ.get('QUALITY_COOLDOWN_FRAMES', 15))
+QUALITY_LEVELS = [
+    {'inference_scale': 1.0, 'jpeg_quality': 95, 'segmentation_refresh': SEGMENTATION_REFRESH_FRAMES,
+     'upload_width': 640, 'upload_quality': 0.8},
+    {'inference_scale': 0.75, 'jpeg_quality': 85, 'segmentation_refresh': SEGMENTATION_REFRESH_FRAMES + 3,
+     'upload_width': 640, 'upload_quality': 0.7},
+    {'inference_scale': 0.75, 'jpeg_quality': 75, 'segmentation_refresh': SEGMENTATION_REFRESH_FRAMES + 7,
+     'upload_width': 480, 'upload_quality': 0.6},
+    {'inference_scale': 0.5, 'jpeg_quality': 65, 'segmentation_refresh': SEGMENTATION_REFRESH_FRAMES + 15,
+     'upload_width': 320, 'upload_quality': 0.5}
+]
+
+# Model lifecycle: 'background' builds and warms the pipelines on a thread at import,
+# 'eager' blocks the import until they are hot, 'deferred' waits for pipeline_pool.start()
+# (gunicorn.conf.py calls it in each worker after fork, or the first frame does)
+MODEL_INIT = os.environ.get('MODEL_INIT', 'background')
+WARMUP_FRAMES = int(os.environ.get('WARMUP_FRAMES', 2))
+# Under several workers each one publishes its pipeline status here (gunicorn.conf.py sets both),
+# so /readyz can wait for all WORKER_COUNT workers instead of the one that answers the probe
+WORKER_STATUS_DIR = os.environ.get('WORKER_STATUS_DIR')
+WORKER_COUNT = int(os.environ.get('WORKER_COUNT', 1))
+
+# Under several workers each one writes its metrics here and /metrics sums them (gunicorn.conf.py
+# sets it); without it /metrics only shows the process that answers the scrape
+METRICS_DIR = os.environ.get('METRICS_DIR')
+
+# Exposes /debug/profiler so the sampling profiler can be switched on at runtime
+ENABLE_PROFILER = os.environ.get('ENABLE_PROFILER', '0') == '1'
+
+# Response modes a client may ask for; anything else is rejected before it becomes a metric label
+FRAME_MODES = ('image', 'state')
+
+# Size of the segmentation mask sent in state-only responses
+STATE_MASK_WIDTH = 160
+STATE_MASK_HEIGHT = 120
+
+# Rough footprint of a session without any cached frame buffers
+SESSION_BASE_BYTES = 64 * 1024
+
+STAGE_SECONDS = Histogram('elements_stage_seconds', 'Time spent in each frame processing stage', ['stage'])
+REQUEST_SECONDS = Histogram('elements_request_seconds', 'HTTP request latency by route', ['route', 'method'])
+FRAMES_TOTAL = Counter('elements_frames_total', 'Frames processed', ['mode'])
+FRAME_ERRORS_TOTAL = Counter('elements_frame_errors_total', 'Frames that failed to process')
+SOUND_EVENTS_TOTAL = Counter('elements_sound_events_total', 'Sound events sent to clients', ['sound'])
+ARENA_ALLOCATIONS_TOTAL = Counter('elements_arena_allocations_total',
+                                  'Frame buffers allocated by session arenas (flat in steady state)')
+HAND_INFERENCE_TOTAL = Counter('elements_hand_inference_total',
+                               'Frames where hand tracking ran or reused the last landmarks', ['result'])
+HAND_REGION_TOTAL = Counter('elements_hand_region_total',
+                            'Hand tracking runs by input region (full, roi, or fallback after a lost ROI)',
+                            ['region'])
+PIPELINE_STARTUP_SECONDS = Histogram('elements_pipeline_startup_seconds',
+                                     'Time to build and warm up each MediaPipe pipeline', ['phase'],
+                                     buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+
+@contextmanager
+def stage_timer(timings, stage):
+    # Records the wall time of one processing stage in milliseconds
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = (time.perf_counter() - start) * 1000
+
+class MediaPipePipeline:
+    def __init__(self, pipeline_id, parallel=PARALLEL_INFERENCE):
+        self.pipeline_id = pipeline_id
+        # Helper thread that runs segmentation while the caller runs hand tracking
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'pipeline-{pipeline_id}') \
+            if parallel else None
+
         # Initialize MediaPipe
-        logger.debug("Setting up MediaPipe")
+        logger.debug(f"Setting up MediaPipe pipeline {pipeline_id}")
         self.mp_hands = mp.solutions.hands
+        # Static mode: a pooled graph serves every session, so it must not carry hands from
+        # one frame into the next. Per-session reuse lives in HandMotionGate instead.
         self.hands = self.mp_hands.Hands(
-            static_image_mode=False,
+            static_image_mode=True,
             max_num_hands=2,
             min_detection_confidence=0.5
         )
-        
+
         # Initialize MediaPipe Selfie Segmentation
         self.mp_selfie_segmentation = mp.solutions.selfie_segmentation
         self.selfie_segmentation = self.mp_selfie_segmentation.SelfieSegmentation(model_selection=0)
-        
+
+        # Separate graph for ROI crops, whose size changes every frame, so the full-frame graph
+        # keeps its buffers. Static mode for the same reason as above: the crop position is per
+        # session, and HandROITracker holds it.
+        self.roi_hands = self.mp_hands.Hands(
+            static_image_mode=True,
+            max_num_hands=2,
+            min_detection_confidence=0.5
+        ) if HAND_ROI else None
+
+    def warm_up(self, image_rgb, frames=WARMUP_FRAMES):
+        # The first calls allocate tensors and pick kernels; pay that before real traffic does.
+        # Segmentation sees the same reduced size SegmentationStage feeds it.
+        height, width = image_rgb.shape[:2]
+        small = cv2.resize(image_rgb, (max(1, int(width * SEGMENTATION_SCALE)),
+                                       max(1, int(height * SEGMENTATION_SCALE))))
+        for _ in range(frames):
+            self.hands.process(image_rgb)
+            self.selfie_segmentation.process(small)
+            if self.roi_hands is not None:
+                self.roi_hands.process(np.ascontiguousarray(image_rgb[:height // 2, :width // 2]))
+
+    def run_beside(self, fn, *args):
+        # Starts fn on the helper thread and returns its future, or runs it inline when disabled
+        if self.executor is None:
+            fn(*args)
+            return None
+        return self.executor.submit(fn, *args)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.hands.close()
+        self.selfie_segmentation.close()
+        if self.roi_hands is not None:
+            self.roi_hands.close()
+
+def warmup_frame(width=640, height=480):
+    # Content doesn't matter for warm-up, only that every graph runs at the real frame size
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:] = np.linspace(0, 255, width, dtype=np.uint8)[None, :, None]
+    return frame
+
+class PipelinePool:
+    # Pipelines are built by start(), in the background by default, and join the pool one
+    # by one as they finish warming up, so the first frames can be served before the rest.
+    # on_change receives status() whenever it changes, so other workers can see it.
+    def __init__(self, size, on_change=None):
+        self.size = max(1, size)
+        self.on_change = on_change
+        self._pipelines = []
+        self._idle = []
+        self._condition = threading.Condition()
+        self.started_at = None
+        self.cold_start_seconds = None
+        self.startup_seconds = {'build': 0.0, 'warmup': 0.0}
+        self.error = None
+
+    @property
+    def in_use(self):
+        with self._condition:
+            return len(self._pipelines) - len(self._idle)
+
+    @property
+    def built(self):
+        with self._condition:
+            return len(self._pipelines)
+
+    @property
+    def ready(self):
+        return self.built == self.size
+
+    def start(self, background=True):
+        # Later calls are no-ops, so every entry point can call it
+        with self._condition:
+            if self.started_at is not None:
+                return
+            self.started_at = time.perf_counter()
+        self._changed()
+        if background:
+            threading.Thread(target=self._build, name='pipeline-startup', daemon=True).start()
+        else:
+            self._build()
+
+    def _build(self):
+        frame = warmup_frame()
+        try:
+            for i in range(self.size):
+                start = time.perf_counter()
+                pipeline = MediaPipePipeline(i)
+                built = time.perf_counter()
+                pipeline.warm_up(frame)
+                warmed = time.perf_counter()
+                PIPELINE_STARTUP_SECONDS.observe(built - start, phase='build')
+                PIPELINE_STARTUP_SECONDS.observe(warmed - built, phase='warmup')
+                with self._condition:
+                    self.startup_seconds['build'] += built - start
+                    self.startup_seconds['warmup'] += warmed - built
+                    self._pipelines.append(pipeline)
+                    self._idle.append(pipeline)
+                    self._condition.notify_all()
+                if i < self.size - 1:
+                    self._changed()
+            self.cold_start_seconds = time.perf_counter() - self.started_at
+            logger.info(f"{self.size} MediaPipe pipelines ready in {self.cold_start_seconds:.2f}s")
+        except Exception as e:
+            logger.error(f"Error starting MediaPipe pipelines: {e}")
+            with self._condition:
+                self.error = str(e)
+                self._condition.notify_all()
+        self._changed()
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self.status())
+
+    def wait_ready(self, timeout=None):
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._pipelines) == self.size or self.error, timeout)
+            return len(self._pipelines) == self.size
+
+    def status(self):
+        with self._condition:
+            return {
+                'ready': len(self._pipelines) == self.size,
+                'pipelines_ready': len(self._pipelines),
+                'pipelines_total': self.size,
+                'cold_start_seconds': self.cold_start_seconds,
+                'startup_seconds': dict(self.startup_seconds),
+                'error': self.error
+            }
+
+    @contextmanager
+    def checkout(self, timeout=PIPELINE_CHECKOUT_TIMEOUT):
+        # A deferred pool starts on first use
+        self.start()
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._idle or self.error, timeout):
+                raise TimeoutError("No MediaPipe pipeline available")
+            if not self._idle:
+                raise RuntimeError(f"MediaPipe pipelines failed to start: {self.error}")
+            pipeline = self._idle.pop()
+        try:
+            yield pipeline
+        finally:
+            with self._condition:
+                self._idle.append(pipeline)
+                self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            pipelines = list(self._pipelines)
+        for pipeline in pipelines:
+            pipeline.close()
+
+@lru_cache(maxsize=64)
+def color_tile(size, color):
+    # Solid square tiles are shared by every session, so keep them read-only
+    tile = np.full((size, size, 3), color, dtype=np.uint8)
+    tile.flags.writeable = False
+    return tile
+
+class OverlayLayer:
+    # Element squares and the gold box as precomputed color tiles, blended at 25%
+    # into just their regions. Rebuilt only when the gold box color or frame size changes.
+    def __init__(self, squares, gold_box, square_size):
+        self.squares = squares
+        self.gold_box = gold_box
+        self.square_size = square_size
+        self.regions = []
+        self._key = None
+
+    def _build(self, frame_shape):
+        size = self.square_size
+        boxes = [(info['position'], info['color']) for info in self.squares.values()]
+        boxes.append((self.gold_box['position'], tuple(self.gold_box['color'])))
+        self.regions = []
+        for (x, y), color in boxes:
+            # Clip against the frame in case it is smaller than the game area
+            width, height = min(size, frame_shape[1] - x), min(size, frame_shape[0] - y)
+            if width > 0 and height > 0:
+                self.regions.append((slice(y, y + height), slice(x, x + width),
+                                     color_tile(size, color)[:height, :width]))
+
+    def blend(self, image_rgb):
+        key = (image_rgb.shape, tuple(self.gold_box['color']))
+        if key != self._key:
+            self._build(image_rgb.shape)
+            self._key = key
+        for rows, cols, tile in self.regions:
+            roi = image_rgb[rows, cols]
+            cv2.addWeighted(tile, 0.25, roi, 0.75, 0, dst=roi)
+
+class SegmentationStage:
+    def __init__(self, arena=None, scale=SEGMENTATION_SCALE, refresh_frames=SEGMENTATION_REFRESH_FRAMES,
+                 motion_threshold=SEGMENTATION_MOTION_THRESHOLD):
+        self.arena = arena if arena is not None else FrameArena()
+        self.scale = scale
+        self.refresh_frames = max(1, refresh_frames)
+        self.motion_threshold = motion_threshold
+        self.refreshes = 0
+        self.reuses = 0
+        self.reset()
+
+    def reset(self):
+        # Buffers stay in the arena for the next refresh, only the cached result is dropped
+        self.small_mask = None  # model output at the reduced resolution
+        self.condition = None  # single-channel person mask at frame resolution
+        self.frames_since_refresh = 0
+        self._motion_probe = None
+        self._probe_slot = 0
+        self._color = None
+        self._color_plane = None
+
+    def nbytes(self):
+        # The model output; everything else lives in the arena
+        return self.small_mask.nbytes if self.small_mask is not None else 0
+
+    def _needs_refresh(self, image_rgb, probe):
+        if self.condition is None or self.condition.shape != image_rgb.shape[:2]:
+            return True
+        if self.frames_since_refresh >= self.refresh_frames:
+            return True
+        diff = cv2.absdiff(probe, self._motion_probe, dst=self.arena.get('segmentation_probe_diff', probe.shape))
+        return float(diff.mean()) > self.motion_threshold
+
+    def update(self, image_rgb, selfie_segmentation):
+        arena = self.arena
+        probe_width, probe_height = MOTION_PROBE_SIZE
+        small_rgb = cv2.resize(image_rgb, MOTION_PROBE_SIZE, dst=arena.get('segmentation_probe_rgb',
+                                                                           (probe_height, probe_width, 3)),
+                               interpolation=cv2.INTER_AREA)
+        # Two probe buffers take turns, so the one kept from the last refresh is never overwritten
+        probe = cv2.cvtColor(small_rgb, cv2.COLOR_RGB2GRAY,
+                             dst=arena.get(f'segmentation_probe_{self._probe_slot}', (probe_height, probe_width)))
+        if not self._needs_refresh(image_rgb, probe):
+            self.frames_since_refresh += 1
+            self.reuses += 1
+            return
+
+        height, width = image_rgb.shape[:2]
+        if self.scale < 1:
+            size = (max(1, int(width * self.scale)), max(1, int(height * self.scale)))
+            small = cv2.resize(image_rgb, size, dst=arena.get('segmentation_input', (size[1], size[0], 3)),
+                               interpolation=cv2.INTER_AREA)
+        else:
+            small = image_rgb
+        self.small_mask = selfie_segmentation.process(small).segmentation_mask
+        full_mask = cv2.resize(self.small_mask, (width, height),
+                               dst=arena.get('segmentation_full_mask', (height, width), np.float32),
+                               interpolation=cv2.INTER_LINEAR)
+        self.condition = np.greater(full_mask, 0.1, out=arena.get('segmentation_condition', (height, width), bool))
+        self._motion_probe = probe
+        self._probe_slot = 1 - self._probe_slot
+        self.frames_since_refresh = 0
+        self.refreshes += 1
+
+    def blend(self, image_rgb, mask_color):
+        # Tint the person at 20% in place; the single-channel condition broadcasts over RGB
+        tinted = self.arena.get('mask_tinted', image_rgb.shape)
+        color_plane = self.arena.get('mask_color_plane', image_rgb.shape)
+        if color_plane is not self._color_plane or self._color != mask_color:
+            color_plane[:] = mask_color
+            self._color_plane = color_plane
+            self._color = mask_color
+        cv2.addWeighted(image_rgb, 0.8, color_plane, 0.2, 0, dst=tinted)
+        np.copyto(image_rgb, tinted, where=self.condition[..., None])
+
+class HandMotionGate:
+    def __init__(self, arena=None, enabled=HAND_MOTION_GATE, threshold=HAND_MOTION_THRESHOLD,
+                 max_reuse=HAND_REUSE_MAX_FRAMES):
+        self.arena = arena if arena is not None else FrameArena()
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_reuse = max(0, max_reuse)
+        self.inferences = 0
+        self.reuses = 0
+        self.reset()
+
+    def reset(self):
+        self.hands = None  # landmarks from the last frame that ran the hand model
+        self.reused_frames = 0
+        self._probe = None  # grey probe of that frame
+        self._pending_probe = None
+        self._probe_slot = 0
+
+    @property
+    def skip_rate(self):
+        total = self.inferences + self.reuses
+        return self.reuses / total if total else 0.0
+
+    def _motion(self, probe):
+        diff = cv2.absdiff(probe, self._probe, dst=self.arena.get('hand_probe_diff', probe.shape))
+        motion = float(diff.mean())
+        if self.hands:
+            # A moving hand is small next to the frame, so also check the area around the last landmarks
+            height, width = diff.shape
+            xs = [landmark.x for hand in self.hands for landmark in hand.landmark]
+            ys = [landmark.y for hand in self.hands for landmark in hand.landmark]
+            x0, x1 = int(min(xs) * width) - HAND_MOTION_PADDING, int(max(xs) * width) + HAND_MOTION_PADDING + 1
+            y0, y1 = int(min(ys) * height) - HAND_MOTION_PADDING, int(max(ys) * height) + HAND_MOTION_PADDING + 1
+            region = diff[max(0, y0):max(0, y1), max(0, x0):max(0, x1)]
+            if region.size:
+                motion = max(motion, float(region.mean()))
+        return motion
+
+    def check(self, image_rgb):
+        # Returns the landmarks to reuse for this frame, or None when the hand model has to run
+        if not self.enabled:
+            return None
+        probe_width, probe_height = HAND_MOTION_PROBE_SIZE
+        small = cv2.resize(image_rgb, HAND_MOTION_PROBE_SIZE,
+                           dst=self.arena.get('hand_probe_rgb', (probe_height, probe_width, 3)),
+                           interpolation=cv2.INTER_AREA)
+        # Written into whichever of two buffers doesn't hold the reference probe
+        probe = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY,
+                             dst=self.arena.get(f'hand_probe_{self._probe_slot}', (probe_height, probe_width)))
+        self._pending_probe = probe
+        if (self.hands is None or self._probe is None or self.reused_frames >= self.max_reuse or
+                self._motion(probe) > self.threshold):
+            return None
+        self.reused_frames += 1
+        self.reuses += 1
+        return self.hands
+
+    def record(self, hands):
+        # Motion is always measured against the last frame the model saw, so slow drift still adds up
+        self.hands = hands
+        if self._pending_probe is not None:
+            self._probe = self._pending_probe
+            self._probe_slot = 1 - self._probe_slot
+        self.reused_frames = 0
+        self.inferences += 1
+
+def scale_for_inference(image_rgb, scale, arena=None):
+    if scale >= 1:
+        return image_rgb
+    height, width = image_rgb.shape[:2]
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    dst = arena.get('inference_input', (size[1], size[0], 3)) if arena is not None else None
+    return cv2.resize(image_rgb, size, dst=dst, interpolation=cv2.INTER_AREA)
+
+class HandROITracker:
+    def __init__(self, arena=None, enabled=HAND_ROI, padding=HAND_ROI_PADDING,
+                 full_frame_interval=HAND_ROI_FULL_FRAME_INTERVAL):
+        self.arena = arena if arena is not None else FrameArena()
+        self.enabled = enabled
+        self.padding = padding
+        self.full_frame_interval = max(1, full_frame_interval)
+        self.roi_frames = 0
+        self.full_frames = 0
+        self.reset()
+
+    def reset(self):
+        self.box = None  # normalized (x0, y0, x1, y1) to crop on the next frame
+        self.frames_since_full = 0
+
+    @property
+    def roi_rate(self):
+        total = self.roi_frames + self.full_frames
+        return self.roi_frames / total if total else 0.0
+
+    def _next_box(self, results, width, height):
+        hands = results.multi_hand_landmarks or []
+        scores = [handedness.classification[0].score for handedness in results.multi_handedness or []]
+        if not hands or min(scores, default=0) < HAND_ROI_MIN_SCORE:
+            return None
+        # Pad in pixels and keep the crop square, the shape the landmark model expects
+        xs = [landmark.x * width for hand in hands for landmark in hand.landmark]
+        ys = [landmark.y * height for hand in hands for landmark in hand.landmark]
+        center_x, center_y = (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2
+        side = max(max(xs) - min(xs), max(ys) - min(ys)) * (1 + 2 * self.padding)
+        side = max(side, HAND_ROI_MIN_SIZE)
+        x0, x1 = max(0, center_x - side / 2), min(width, center_x + side / 2)
+        y0, y1 = max(0, center_y - side / 2), min(height, center_y + side / 2)
+        if x1 - x0 < 2 or y1 - y0 < 2 or (x1 - x0) * (y1 - y0) > HAND_ROI_MAX_AREA * width * height:
+            return None
+        return (x0 / width, y0 / height, x1 / width, y1 / height)
+
+    def _process_roi(self, roi_hands, image_rgb):
+        height, width = image_rgb.shape[:2]
+        x0, y0 = int(self.box[0] * width), int(self.box[1] * height)
+        x1, y1 = int(np.ceil(self.box[2] * width)), int(np.ceil(self.box[3] * height))
+        # The crop size changes every frame, so it is copied into a view of one growing buffer
+        crop = self.arena.view('hand_roi', (y1 - y0, x1 - x0, 3))
+        np.copyto(crop, image_rgb[y0:y1, x0:x1])
+        results = roi_hands.process(crop)
+        # Map crop-normalized landmarks back to frame-normalized ones; z shares the x scale
+        scale_x, scale_y = (x1 - x0) / width, (y1 - y0) / height
+        for hand in results.multi_hand_landmarks or []:
+            for landmark in hand.landmark:
+                landmark.x = x0 / width + landmark.x * scale_x
+                landmark.y = y0 / height + landmark.y * scale_y
+                landmark.z *= scale_x
+        return results
+
+    def process(self, pipeline, image_rgb, scale=1.0):
+        # Returns the hand landmarks for this frame, normalized to the full frame
+        results = None
+        if (self.enabled and pipeline.roi_hands is not None and self.box is not None and
+                self.frames_since_full < self.full_frame_interval):
+            results = self._process_roi(pipeline.roi_hands, image_rgb)
+            if results.multi_hand_landmarks:
+                self.frames_since_full += 1
+                self.roi_frames += 1
+                HAND_REGION_TOTAL.inc(region='roi')
+            else:
+                # Tracking lost inside the crop, look at the whole frame again
+                results = None
+                HAND_REGION_TOTAL.inc(region='fallback')
+        if results is None:
+            results = pipeline.hands.process(scale_for_inference(image_rgb, scale, self.arena))
+            self.frames_since_full = 0
+            self.full_frames += 1
+            HAND_REGION_TOTAL.inc(region='full')
+        if self.enabled:
+            self.box = self._next_box(results, image_rgb.shape[1], image_rgb.shape[0])
+        return results.multi_hand_landmarks or []
+
+class QualityController:
+    # Tracks smoothed server time per frame (processing plus the wait for a pipeline) and moves
+    # one quality level at a time to keep it within the frame budget. The client's round-trip
+    # time is only reported: it includes network latency that no quality level can reduce, and
+    # with several frames in flight a client's frame rate is not 1 / RTT anyway.
+    def __init__(self, target_fps=TARGET_FPS, enabled=ADAPTIVE_QUALITY, levels=QUALITY_LEVELS,
+                 cooldown_frames=QUALITY_COOLDOWN_FRAMES):
+        self.enabled = enabled
+        self.levels = levels
+        self.budget_ms = 1000 / target_fps
+        self.cooldown_frames = cooldown_frames
+        self.level = 0
+        self.processing_ms = None
+        self.queue_ms = None
+        self.rtt_ms = None
+        self._frames_since_change = 0
+
+    @staticmethod
+    def _smooth(current, sample, alpha=0.2):
+        return sample if current is None else current + alpha * (sample - current)
+
+    def observe_processing(self, ms):
+        self.processing_ms = self._smooth(self.processing_ms, ms)
+
+    def observe_queue(self, ms):
+        self.queue_ms = self._smooth(self.queue_ms, ms)
+
+    def observe_rtt(self, ms):
+        if ms > 0:
+            self.rtt_ms = self._smooth(self.rtt_ms, ms)
+
+    @property
+    def frame_ms(self):
+        if self.processing_ms is None:
+            return None
+        return self.processing_ms + (self.queue_ms or 0)
+
+    def update(self):
+        self._frames_since_change += 1
+        frame_ms = self.frame_ms
+        if not self.enabled or frame_ms is None or self._frames_since_change < self.cooldown_frames:
+            return
+        if frame_ms > self.budget_ms * 1.1 and self.level < len(self.levels) - 1:
+            self.level += 1
+        elif frame_ms < self.budget_ms * 0.7 and self.level > 0:
+            self.level -= 1
+        else:
+            return
+        self._frames_since_change = 0
+        logger.debug(f"Quality level {self.level} at {frame_ms:.1f}ms per frame")
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    def report(self):
+        report = dict(self.settings, level=self.level, target_fps=round(1000 / self.budget_ms, 2))
+        if self.frame_ms is not None:
+            report['frame_ms'] = round(self.frame_ms, 2)
+        if self.rtt_ms is not None:
+            report['client_rtt_ms'] = round(self.rtt_ms, 2)
+        return report
+
+class WebElementGame:
+    def __init__(self, pool):
+        self.pool = pool
+        self.width = 640  # Standard webcam width
+        self.height = 480  # Standard webcam height
+        self.square_size = min(self.width, self.height) // 4
+
+        # Graphs live in the shared pool, only the solution constants are kept here
+        self.mp_hands = mp.solutions.hands
         self.mp_drawing = mp.solutions.drawing_utils
+
+        # Serializes frames coming from the same session
+        self.lock = threading.Lock()
+        self.last_seen = time.time()
+        self.stage_timings = {}
         
         # Initialize squares with same colors and positions as original
         self.squares = {
@@ -61,6 +697,7 @@ class WebElementGame:
             'color': (255, 255, 0),
             'position': ((self.width - self.square_size) // 2, self.height - self.square_size)
         }
+        self.overlay = OverlayLayer(self.squares, self.gold_box, self.square_size)
         
         # Initialize state tracking
         self.finger_in_box = {element: False for element in self.squares}
@@ -69,17 +706,45 @@ class WebElementGame:
         self.gold_achieved = False
         self.mask_color = None
         
-        # Load emoji font
-        logger.debug("Loading emoji font")
-        try:
-            self.emoji_font = ImageFont.truetype("seguiemj.ttf", 48)
-            logger.debug("Emoji font loaded successfully")
-        except Exception as e:
-            logger.error(f"Error loading emoji font: {e}")
-            raise
+        self.emoji_sprites = get_sprite_cache(tuple(self.squares))
+        self.codec = get_codec(FRAME_CODEC)
+        self.output_format = FRAME_OUTPUT_FORMAT if FRAME_OUTPUT_FORMAT in ('jpeg', 'webp') else 'jpeg'
+        # Reusable frame buffers for every stage of this session's frames
+        self.arena = FrameArena()
+        self.segmentation = SegmentationStage(self.arena)
+        self.hand_gate = HandMotionGate(self.arena)
+        self.hand_roi = HandROITracker(self.arena)
+        self.quality = QualityController()
             
         self.reset_word_positions()
 
+    def to_state(self):
+        # Everything a frame may change, so any worker can pick the session up
+        return {
+            'word_positions': {element: list(position) for element, position in self.word_positions.items()},
+            'grabbed_word': self.grabbed_word,
+            'mask_color': list(self.mask_color) if self.mask_color is not None else None,
+            'gold_box_color': list(self.gold_box['color']),
+            'gold_achieved': self.gold_achieved,
+            'finger_in_box': dict(self.finger_in_box),
+            'last_sound_time': dict(self.last_sound_time)
+        }
+
+    def load_state(self, state):
+        self.word_positions = {element: tuple(position) for element, position in state['word_positions'].items()}
+        self.grabbed_word = state['grabbed_word']
+        mask_color = tuple(state['mask_color']) if state['mask_color'] is not None else None
+        if mask_color is None:
+            self.segmentation.reset()
+        self.mask_color = mask_color
+        self.gold_box['color'] = tuple(state['gold_box_color'])
+        self.gold_achieved = state['gold_achieved']
+        self.finger_in_box = dict(state['finger_in_box'])
+        self.last_sound_time = dict(state['last_sound_time'])
+
+    def estimated_bytes(self):
+        return SESSION_BASE_BYTES + self.segmentation.nbytes() + self.arena.nbytes()
+
     def reset_word_positions(self):
         self.word_positions = {
             element: (info['position'][0] + self.square_size // 2,
@@ -89,6 +754,7 @@ class WebElementGame:
         self.gold_achieved = False
         self.grabbed_word = None
         self.mask_color = None
+        self.segmentation.reset()
 
     def is_hand_closed(self, hand_landmarks):
         thumb_tip = hand_landmarks.landmark[self.mp_hands.HandLandmark.THUMB_TIP]
@@ -99,122 +765,369 @@ class WebElementGame:
         return (box_position[0] < point[0] < box_position[0] + box_size and
                 box_position[1] < point[1] < box_position[1] + box_size)
 
+    def update_segmentation(self, image_rgb, pipeline):
+        with stage_timer(self.stage_timings, 'segmentation'):
+            self.segmentation.update(image_rgb, pipeline.selfie_segmentation)
+
     def apply_mask(self, image_rgb):
-        results = self.selfie_segmentation.process(image_rgb)
-        condition = np.stack((results.segmentation_mask,) * 3, axis=-1) > 0.1
-        if self.mask_color is not None:
-            overlay = np.zeros(image_rgb.shape, dtype=np.uint8)
-            overlay[:] = self.mask_color
-            overlay = cv2.addWeighted(image_rgb, 0.8, overlay, 0.2, 0)
-            image_rgb = np.where(condition, overlay, image_rgb)
+        # Segmentation is only needed once an element has tinted the player
+        if self.mask_color is None or self.segmentation.condition is None:
+            return image_rgb
+        self.segmentation.blend(image_rgb, self.mask_color)
         return image_rgb
 
-    def process_frame(self, frame_data):
+    def process_frame(self, frame_data, mode='image', include_mask=False):
         try:
             # Decode base64 image
             image_data = base64.b64decode(frame_data.split(',')[1])
-            nparr = np.frombuffer(image_data, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = self.hands.process(image_rgb)
-            
-            # Apply mask first
-            image_rgb = self.apply_mask(image_rgb)
-            
-            # Draw squares
-            overlay = image_rgb.copy()
-            for element, info in self.squares.items():
-                cv2.rectangle(overlay, info['position'],
-                            (info['position'][0] + self.square_size,
-                             info['position'][1] + self.square_size),
-                            info['color'], -1)
-            cv2.addWeighted(overlay, 0.25, image_rgb, 0.75, 0, image_rgb)
-            
-            # Draw gold box
-            cv2.rectangle(overlay, self.gold_box['position'],
-                         (self.gold_box['position'][0] + self.square_size,
-                          self.gold_box['position'][1] + self.square_size),
-                         self.gold_box['color'], -1)
-            cv2.addWeighted(overlay, 0.25, image_rgb, 0.75, 0, image_rgb)
-            
-            sound_events = []
-            current_time = time.time()
-
-            if results.multi_hand_landmarks:
-                for hand_landmarks in results.multi_hand_landmarks:
-                    self.mp_drawing.draw_landmarks(
-                        image_rgb, hand_landmarks, self.mp_hands.HAND_CONNECTIONS,
-                        self.mp_drawing.DrawingSpec(color=(0, 255, 0), thickness=2, circle_radius=4),
-                        self.mp_drawing.DrawingSpec(color=(255, 0, 0), thickness=2)
-                    )
-                    
-                    index_finger_tip = hand_landmarks.landmark[self.mp_hands.HandLandmark.INDEX_FINGER_TIP]
-                    x, y = int(index_finger_tip.x * self.width), int(index_finger_tip.y * self.height)
-                    
-                    hand_closed = self.is_hand_closed(hand_landmarks)
-                    
-                    if self.grabbed_word:
-                        if hand_closed:
-                            self.word_positions[self.grabbed_word] = (x, y)
-                        else:
-                            if self.is_point_in_box((x, y), self.gold_box['position'], self.square_size):
-                                self.mask_color = self.squares[self.grabbed_word]['color']
-                                if self.grabbed_word == '🔥':
-                                    sound_events.append(self.squares['🔥']['sound'])
-                                
-                                # Check if all emojis are in gold box
-                                emojis_in_gold = sum(1 for pos in self.word_positions.values()
-                                                   if self.is_point_in_box(pos, self.gold_box['position'], self.square_size))
-                                if emojis_in_gold == 4:
-                                    self.gold_achieved = True
-                                    self.gold_box['color'] = (255, 255, 0)
-                                    sound_events.append('Eureka.wav')
-                                else:
-                                    self.gold_box['color'] = self.mask_color
-                            self.grabbed_word = None
-                    else:
-                        for element, info in self.squares.items():
-                            if self.is_point_in_box((x, y), info['position'], self.square_size):
-                                if not self.finger_in_box[element]:
-                                    self.finger_in_box[element] = True
-                                    if current_time - self.last_sound_time[element] > 1:
-                                        if element != '🔥':
-                                            sound_events.append(info['sound'])
-                                        self.last_sound_time[element] = current_time
-                                if hand_closed and not self.grabbed_word:
-                                    self.grabbed_word = element
-                            else:
-                                self.finger_in_box[element] = False
-
-            # Draw emojis
-            pil_image = Image.fromarray(image_rgb)
-            draw = ImageDraw.Draw(pil_image)
-            for element, position in self.word_positions.items():
-                draw.text((position[0], position[1]), element,
-                         font=self.emoji_font, fill=(255, 255, 255), anchor="mm")
+        except Exception as e:
+            logger.warning(f"Could not decode frame: {e}")
+            return {'success': False, 'error': str(e), 'invalid_frame': True}
 
+        result = self.process_frame_bytes(image_data, mode, include_mask)
+        if result['success'] and 'encoded' in result:
             # Convert back to base64
-            buffered = io.BytesIO()
-            pil_image.save(buffered, format="JPEG", quality=95)
-            img_str = base64.b64encode(buffered.getvalue()).decode()
+            img_str = base64.b64encode(result.pop('encoded')).decode()
+            result['image'] = f"data:{result.pop('mimetype')};base64,{img_str}"
+        return result
 
-            return {
+    def process_frame_bytes(self, image_data, mode='image', include_mask=False):
+        # mode='image' returns the composited frame, mode='state' returns only
+        # the game state so the browser can draw the overlay itself
+        self.stage_timings = timings = {}
+        self.arena.begin_frame()
+        start = time.perf_counter()
+        try:
+            with stage_timer(timings, 'decode'):
+                # Decoders that support it write into last frame's buffer; the rest allocate once per frame
+                decoded = self.arena.find('decoded')
+                try:
+                    image_rgb = self.arena.adopt('decoded', self.codec.decode_rgb(image_data, out=decoded))
+                except Exception as e:
+                    # A body that isn't an image is the client's error, not the server's
+                    logger.warning(f"Could not decode frame: {e}")
+                    return {'success': False, 'error': str(e), 'invalid_frame': True}
+                if mode != 'state' and image_rgb.shape[:2] != (self.height, self.width):
+                    # Clients may upload below game resolution; the overlay is drawn in game pixels
+                    image_rgb = cv2.resize(image_rgb, (self.width, self.height),
+                                           dst=self.arena.get('game_frame', (self.height, self.width, 3)),
+                                           interpolation=cv2.INTER_LINEAR)
+
+            settings = self.quality.settings
+            self.segmentation.refresh_frames = settings['segmentation_refresh']
+            needs_mask = mode != 'state' or include_mask
+            with self.pool.checkout() as pipeline:
+                # Segmentation runs beside hand tracking when a mask is already active
+                inference_start = time.perf_counter()
+                segmentation = None
+                if needs_mask and self.mask_color is not None:
+                    segmentation = pipeline.run_beside(self.update_segmentation, image_rgb, pipeline)
+
+                with stage_timer(timings, 'motion'):
+                    hands = self.hand_gate.check(image_rgb)
+                if hands is None:
+                    with stage_timer(timings, 'hands'):
+                        # Landmarks are normalized, so game coordinates don't depend on the inference scale
+                        hands = self.hand_roi.process(pipeline, image_rgb, settings['inference_scale'])
+                    self.hand_gate.record(hands)
+                    HAND_INFERENCE_TOTAL.inc(result='inferred')
+                else:
+                    HAND_INFERENCE_TOTAL.inc(result='reused')
+
+                with stage_timer(timings, 'game_logic'):
+                    sound_events = self.update_game_state(hands)
+
+                if segmentation is not None:
+                    segmentation.result()
+                elif needs_mask and self.mask_color is not None and 'segmentation' not in timings:
+                    # The mask was switched on by this frame's drop
+                    self.update_segmentation(image_rgb, pipeline)
+                timings['inference'] = (time.perf_counter() - inference_start) * 1000
+
+            result = {
                 'success': True,
-                'image': f'data:image/jpeg;base64,{img_str}',
                 'sound_events': sound_events,
                 'gold_achieved': self.gold_achieved
             }
+            if mode == 'state':
+                segmentation_mask = self.segmentation.small_mask if include_mask else None
+                result['state'] = self.export_state(hands, segmentation_mask)
+            else:
+                result['encoded'] = self.render_frame(image_rgb, hands, settings['jpeg_quality'])
+                result['mimetype'] = self.codec.mimetype(self.output_format)
+            timings['total'] = (time.perf_counter() - start) * 1000
+            result['timings'] = {stage: round(ms, 2) for stage, ms in timings.items()}
+
+            self.quality.observe_processing(timings['total'])
+            self.quality.update()
+            result['quality'] = self.quality.report()
+
+            FRAMES_TOTAL.inc(mode=mode)
+            ARENA_ALLOCATIONS_TOTAL.inc(self.arena.frame_allocations)
+            for stage, ms in timings.items():
+                STAGE_SECONDS.observe(ms / 1000, stage=stage)
+            for sound in sound_events:
+                SOUND_EVENTS_TOTAL.inc(sound=sound)
+            return result
 
         except Exception as e:
+            FRAME_ERRORS_TOTAL.inc()
             logger.error(f"Error processing frame: {e}")
             return {'success': False, 'error': str(e)}
 
+    def update_game_state(self, hands):
+        sound_events = []
+        current_time = time.time()
+
+        for hand_landmarks in hands:
+            index_finger_tip = hand_landmarks.landmark[self.mp_hands.HandLandmark.INDEX_FINGER_TIP]
+            x, y = int(index_finger_tip.x * self.width), int(index_finger_tip.y * self.height)
+            
+            hand_closed = self.is_hand_closed(hand_landmarks)
+            
+            if self.grabbed_word:
+                if hand_closed:
+                    self.word_positions[self.grabbed_word] = (x, y)
+                else:
+                    if self.is_point_in_box((x, y), self.gold_box['position'], self.square_size):
+                        self.mask_color = self.squares[self.grabbed_word]['color']
+                        if self.grabbed_word == '🔥':
+                            sound_events.append(self.squares['🔥']['sound'])
+                        
+                        # Check if all emojis are in gold box
+                        emojis_in_gold = sum(1 for pos in self.word_positions.values()
+                                           if self.is_point_in_box(pos, self.gold_box['position'], self.square_size))
+                        if emojis_in_gold == 4:
+                            self.gold_achieved = True
+                            self.gold_box['color'] = (255, 255, 0)
+                            sound_events.append('Eureka.wav')
+                        else:
+                            self.gold_box['color'] = self.mask_color
+                    self.grabbed_word = None
+            else:
+                for element, info in self.squares.items():
+                    if self.is_point_in_box((x, y), info['position'], self.square_size):
+                        if not self.finger_in_box[element]:
+                            self.finger_in_box[element] = True
+                            if current_time - self.last_sound_time[element] > 1:
+                                if element != '🔥':
+                                    sound_events.append(info['sound'])
+                                self.last_sound_time[element] = current_time
+                        if hand_closed and not self.grabbed_word:
+                            self.grabbed_word = element
+                    else:
+                        self.finger_in_box[element] = False
+
+        return sound_events
+
+    def render_frame(self, image_rgb, hands, jpeg_quality=95):
+        timings = self.stage_timings
+
+        # Apply mask first
+        with stage_timer(timings, 'mask'):
+            self.apply_mask(image_rgb)
+
+        # Draw squares and gold box
+        with stage_timer(timings, 'overlay'):
+            self.overlay.blend(image_rgb)
+
+        with stage_timer(timings, 'landmarks'):
+            for hand_landmarks in hands:
+                self.mp_drawing.draw_landmarks(
+                    image_rgb, hand_landmarks, self.mp_hands.HAND_CONNECTIONS,
+                    self.mp_drawing.DrawingSpec(color=(0, 255, 0), thickness=2, circle_radius=4),
+                    self.mp_drawing.DrawingSpec(color=(255, 0, 0), thickness=2)
+                )
+
+        # Draw emojis from the pre-rasterized sprites
+        with stage_timer(timings, 'emoji'):
+            self.emoji_sprites.draw(image_rgb, self.word_positions,
+                                    self.arena.get('emoji_scratch', self.emoji_sprites.max_tile_shape, np.uint16))
+
+        with stage_timer(timings, 'encode'):
+            return self.codec.encode(image_rgb, jpeg_quality, self.output_format)
+
+    def export_state(self, hands, segmentation_mask=None):
+        # Compact per-frame state for clients that composite the overlay themselves.
+        # Positions are in game pixels (width x height), landmarks are normalized.
+        state = {
+            'width': self.width,
+            'height': self.height,
+            'square_size': self.square_size,
+            'hands': [[[round(lm.x, 4), round(lm.y, 4)] for lm in hand_landmarks.landmark]
+                      for hand_landmarks in hands],
+            'word_positions': {element: list(position) for element, position in self.word_positions.items()},
+            'squares': {element: {'position': list(info['position']), 'color': list(info['color'])}
+                        for element, info in self.squares.items()},
+            'gold_box': {'position': list(self.gold_box['position']), 'color': list(self.gold_box['color'])},
+            'mask_color': list(self.mask_color) if self.mask_color is not None else None,
+            'grabbed_word': self.grabbed_word,
+            'mask': None
+        }
+        if segmentation_mask is not None and self.mask_color is not None:
+            state['mask'] = self.encode_state_mask(segmentation_mask)
+        return state
+
+    def encode_state_mask(self, segmentation_mask):
+        # Low-res RGBA tint the client scales over the video: mask color at 20% where a person is
+        small = cv2.resize(segmentation_mask, (STATE_MASK_WIDTH, STATE_MASK_HEIGHT),
+                           dst=self.arena.get('state_mask', (STATE_MASK_HEIGHT, STATE_MASK_WIDTH), np.float32),
+                           interpolation=cv2.INTER_AREA)
+        person = np.greater(small, 0.1, out=self.arena.get('state_mask_person', small.shape, bool))
+        tint = self.arena.get('state_mask_tint', (STATE_MASK_HEIGHT, STATE_MASK_WIDTH, 4))
+        tint[..., :3] = self.mask_color[::-1]  # PNG encoding expects BGR(A)
+        np.multiply(person, 51, out=tint[..., 3], casting='unsafe')
+        ok, png = cv2.imencode('.png', tint)
+        if not ok:
+            return None
+        return 'data:image/png;base64,' + base64.b64encode(png.tobytes()).decode()
+
+class SessionManager:
+    # Local WebElementGame objects are an LRU cache of per-process buffers and models;
+    # the authoritative game state is loaded from and saved to the state store per frame
+    def __init__(self, pool, store=None, max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT,
+                 memory_cap_bytes=SESSION_MEMORY_CAP_MB * 1024 * 1024):
+        self.pool = pool
+        self.store = store if store is not None else create_store()
+        self._last_sweep = time.time()
+        self.max_sessions = max(1, max_sessions)
+        self.idle_timeout = idle_timeout
+        self.memory_cap_bytes = memory_cap_bytes
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            game = self._sessions.get(session_id)
+            if game is None:
+                logger.debug(f"Creating game session {session_id}")
+                game = WebElementGame(self.pool)
+                self._sessions[session_id] = game
+            else:
+                self._sessions.move_to_end(session_id)
+            game.last_seen = now
+            self._evict_locked(now, keep=session_id)
+            return game
+
+    @contextmanager
+    def session(self, session_id):
+        game = self.get(session_id)
+        with game.lock, self.store.lock(session_id):
+            state = self.store.load(session_id)
+            if state is not None:
+                game.load_state(state)
+            yield game
+            self.store.save(session_id, game.to_state(), self.idle_timeout)
+
+    def _evict_locked(self, now, keep):
+        if now - self._last_sweep > STATE_STORE_SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.store.sweep()
+
+        # Oldest sessions sit at the front of the OrderedDict
+        for session_id, game in list(self._sessions.items()):
+            if session_id != keep and now - game.last_seen > self.idle_timeout:
+                del self._sessions[session_id]
+        total_bytes = sum(game.estimated_bytes() for game in self._sessions.values())
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or
+                                           total_bytes > self.memory_cap_bytes):
+            session_id, game = next(iter(self._sessions.items()))
+            if session_id == keep:
+                break
+            del self._sessions[session_id]
+            total_bytes -= game.estimated_bytes()
+            logger.debug(f"Evicted game session {session_id}")
+
+def observe_client_rtt(game, value):
+    # Clients report the round-trip time of their previous frame in milliseconds
+    try:
+        if value is not None:
+            game.quality.observe_rtt(float(value))
+    except (TypeError, ValueError):
+        pass
+
+def skipped_response(reason):
+    return jsonify({'success': False, 'skipped': True, 'reason': reason})
+
+def invalid_mode_response():
+    return jsonify({'success': False, 'error': "mode must be 'image' or 'state'"}), 400
+
+def rejected_response(e):
+    return jsonify({'success': False, 'error': str(e)}), 503, {'Retry-After': str(int(SCHEDULER_ACTIVE_WINDOW))}
+
+def get_session_id():
+    session_id = request.cookies.get(SESSION_COOKIE, '')
+    if not SESSION_ID_PATTERN.match(session_id):
+        session_id = g.get('new_session_id') or uuid.uuid4().hex
+        g.new_session_id = session_id
+    return session_id
+
+def preload():
+    # Fills the process-wide caches (emoji sprites, overlay tiles, codec libraries) by rendering
+    # one frame without inference. Under gunicorn --preload this runs in the master, so
+    # workers share those pages after fork instead of each building their own.
+    start = time.perf_counter()
+    game = WebElementGame(pipeline_pool)
+    game.render_frame(warmup_frame(game.width, game.height), [])
+    logger.info(f"Preloaded frame caches in {time.perf_counter() - start:.2f}s")
+    logger.info(f"Frame codec {game.codec.name} (available: {', '.join(available_codecs())})")
+
 app = Flask(__name__)
-game = WebElementGame()
+sock = Sock(app)
+worker_board = WorkerStatusBoard(WORKER_STATUS_DIR, WORKER_COUNT)
+pipeline_pool = PipelinePool(PIPELINE_POOL_SIZE, on_change=worker_board.publish)
+sessions = SessionManager(pipeline_pool, create_store(STATE_STORE))
+scheduler = FrameScheduler(pipeline_pool.size, SCHEDULER_QUEUE_DEPTH, FRAME_DEADLINE_MS,
+                           SCHEDULER_MAX_ACTIVE_SESSIONS, SCHEDULER_ACTIVE_WINDOW, wait_histogram=STAGE_SECONDS,
+                           known_session=sessions.store.exists)
+profiler = SamplingProfiler()
+metrics_collector = MultiProcessCollector(METRICS_DIR) if METRICS_DIR else None
+
+Gauge('elements_active_sessions', 'Game sessions currently held', function=lambda: len(sessions))
+Gauge('elements_pipelines_in_use', 'MediaPipe pipelines checked out', function=lambda: pipeline_pool.in_use)
+Gauge('elements_pipelines_total', 'MediaPipe pipelines in the pool', function=lambda: pipeline_pool.size)
+Gauge('elements_scheduler_queued_frames', 'Frames waiting for a pipeline', function=lambda: scheduler.queued)
+Gauge('elements_scheduler_running_frames', 'Frames being processed', function=lambda: scheduler.running)
+Gauge('elements_scheduler_active_sessions', 'Sessions that sent a frame recently',
+      function=lambda: scheduler.active_sessions)
+Gauge('elements_pipelines_ready', 'MediaPipe pipelines built and warmed up', function=lambda: pipeline_pool.built)
+Gauge('elements_cold_start_seconds', 'Time from pipeline startup until every pipeline was warm',
+      function=lambda: pipeline_pool.cold_start_seconds or 0, aggregate='max')
+
+preload()
+if MODEL_INIT == 'eager':
+    pipeline_pool.start(background=False)
+elif MODEL_INIT == 'background':
+    pipeline_pool.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request_time(response):
+    start = g.pop('request_start', None)
+    # Websocket handlers return only when the stream closes, so their duration says nothing
+    if start is not None and request.endpoint != 'frame_stream':
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route=route, method=request.method)
+    return response
+
+@app.after_request
+def set_session_cookie(response):
+    new_session_id = g.pop('new_session_id', None)
+    if new_session_id:
+        response.set_cookie(SESSION_COOKIE, new_session_id, httponly=True, samesite='Lax')
+    return response
 
 @app.route('/')
 def index():
+    get_session_id()
     return render_template('index.html')
 
 @app.route('/process_frame', methods=['POST'])
@@ -223,23 +1136,210 @@ def process_frame():
         data = request.get_json()
         if not data or 'frame' not in data:
             return jsonify({'success': False, 'error': 'No frame data received'})
+        mode = data.get('mode', 'image')
+        if mode not in FRAME_MODES:
+            return invalid_mode_response()
         
-        result = game.process_frame(data['frame'])
+        session_id = get_session_id()
+        with scheduler.slot(session_id) as queue_ms, sessions.session(session_id) as game:
+            game.quality.observe_queue(queue_ms)
+            observe_client_rtt(game, data.get('client_rtt', request.headers.get('X-Client-RTT')))
+            result = game.process_frame(data['frame'], mode, bool(data.get('include_mask')))
+        if result['success']:
+            result['timings']['queue'] = round(queue_ms, 2)
         return jsonify(result)
+    except FrameSkipped as e:
+        return skipped_response(e.reason)
+    except SessionRejected as e:
+        return rejected_response(e)
     except Exception as e:
         logger.error(f"Error in process_frame route: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/process_frame_binary', methods=['POST'])
+def process_frame_binary():
+    # Raw image/jpeg body or a multipart upload with a 'frame' part
+    try:
+        upload = request.files.get('frame')
+        image_data = upload.read() if upload else request.get_data()
+        if not image_data:
+            return jsonify({'success': False, 'error': 'No frame data received'}), 400
+
+        mode = request.args.get('mode', 'image')
+        if mode not in FRAME_MODES:
+            return invalid_mode_response()
+        include_mask = request.args.get('mask') == '1'
+        session_id = get_session_id()
+        with scheduler.slot(session_id) as queue_ms, sessions.session(session_id) as game:
+            game.quality.observe_queue(queue_ms)
+            observe_client_rtt(game, request.headers.get('X-Client-RTT'))
+            result = game.process_frame_bytes(image_data, mode, include_mask)
+        if not result['success']:
+            return jsonify(result), 400 if result.get('invalid_frame') else 500
+        result['timings']['queue'] = round(queue_ms, 2)
+        if mode == 'state':
+            return jsonify(result)
+
+        return Response(result['encoded'], mimetype=result['mimetype'], headers={
+            'X-Sound-Events': json.dumps(result['sound_events']),
+            'X-Gold-Achieved': 'true' if result['gold_achieved'] else 'false',
+            'Server-Timing': ', '.join(f'{stage};dur={ms}' for stage, ms in result['timings'].items()),
+            'X-Quality': json.dumps(result['quality']),
+            'Cache-Control': 'no-store'
+        })
+    except FrameSkipped as e:
+        # Nothing to draw, the client keeps showing its previous frame
+        return Response(status=204, headers={'X-Frame-Skipped': e.reason, 'Cache-Control': 'no-store'})
+    except SessionRejected as e:
+        return rejected_response(e)
+    except Exception as e:
+        logger.error(f"Error in process_frame_binary route: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@sock.route('/ws')
+def frame_stream(ws):
+    # Binary messages are JPEG frames. Every frame is acked on receipt, and frames
+    # replaced in the inbox before processing are reported so the client can pace capture.
+    mode = request.args.get('mode', 'image')
+    include_mask = request.args.get('mask') == '1'
+    inbox = LatestFrameSlot()
+    send_lock = threading.Lock()
+    session_id = get_session_id()
+
+    def send(message):
+        with send_lock:
+            ws.send(message)
+
+    if mode not in FRAME_MODES:
+        # flask-sock closes the socket once the handler returns
+        send(json.dumps({'type': 'error', 'error': "mode must be 'image' or 'state'"}))
+        return
+
+    try:
+        scheduler.admit(session_id)
+    except SessionRejected as e:
+        # flask-sock closes the socket once the handler returns
+        send(json.dumps({'type': 'rejected', 'error': str(e), 'retry_after': SCHEDULER_ACTIVE_WINDOW}))
+        return
+
+    def receive_frames():
+        seq = 0
+        try:
+            while True:
+                message = ws.receive()
+                if not isinstance(message, (bytes, bytearray)):
+                    # Text messages carry client stats, e.g. {"type": "stats", "rtt": 84.5}
+                    try:
+                        stats = json.loads(message)
+                    except ValueError:
+                        continue
+                    if isinstance(stats, dict) and stats.get('type') == 'stats':
+                        observe_client_rtt(sessions.get(session_id), stats.get('rtt'))
+                    continue
+                seq += 1
+                replaced = inbox.put(seq, bytes(message))
+                if replaced is not None:
+                    DROPPED_FRAMES_TOTAL.inc(reason='replaced')
+                send(json.dumps({'type': 'ack', 'seq': seq, 'replaced': replaced}))
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            logger.error(f"Error receiving websocket frame: {e}")
+        finally:
+            inbox.close()
+
+    threading.Thread(target=receive_frames, daemon=True).start()
+
+    try:
+        while True:
+            frame = inbox.take()
+            if frame is None:
+                break
+            seq, image_data = frame
+
+            try:
+                with scheduler.slot(session_id) as queue_ms, sessions.session(session_id) as game:
+                    game.quality.observe_queue(queue_ms)
+                    result = game.process_frame_bytes(image_data, mode, include_mask)
+            except FrameSkipped as e:
+                send(json.dumps({'type': 'result', 'success': False, 'skipped': True, 'reason': e.reason,
+                                 'seq': seq, 'dropped': inbox.dropped, 'has_image': False}))
+                continue
+            except SessionRejected as e:
+                send(json.dumps({'type': 'rejected', 'error': str(e), 'retry_after': SCHEDULER_ACTIVE_WINDOW}))
+                break
+            if result['success']:
+                result['timings']['queue'] = round(queue_ms, 2)
+            encoded = result.pop('encoded', None)
+            result.update({'type': 'result', 'seq': seq, 'dropped': inbox.dropped,
+                           'has_image': encoded is not None})
+            send(json.dumps(result))
+            if encoded is not None:
+                send(encoded)
+    except ConnectionClosed:
+        pass
+    except Exception as e:
+        logger.error(f"Error in websocket frame stream: {e}")
+    finally:
+        inbox.close()
+
+@app.route('/healthz')
+def healthz():
+    # Liveness: the process is up and answering, whether or not inference is warm
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    # Readiness: every pipeline of every worker is built and warmed up, so no frame pays
+    # cold-start cost whichever worker it lands on
+    if pipeline_pool.started_at is None:
+        # Nothing has started a deferred pool yet; the probe does, so readiness can be reached
+        pipeline_pool.start()
+    status = worker_board.summary()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics')
+def metrics():
+    text = metrics_collector.render() if metrics_collector is not None else REGISTRY.render()
+    return Response(text, mimetype=METRICS_CONTENT_TYPE)
+
+@app.route('/debug/profiler', methods=['GET', 'POST'])
+def profiler_control():
+    # POST ?action=start[&interval=0.005] or ?action=stop; GET returns collapsed stacks
+    if not ENABLE_PROFILER:
+        return jsonify({'success': False, 'error': 'Profiler is disabled'}), 404
+    try:
+        if request.method == 'POST':
+            action = request.args.get('action')
+            if action == 'start':
+                changed = profiler.start(request.args.get('interval', type=float))
+            elif action == 'stop':
+                changed = profiler.stop()
+            else:
+                return jsonify({'success': False, 'error': "action must be 'start' or 'stop'"}), 400
+            return jsonify({'success': True, 'changed': changed, 'running': profiler.running,
+                            'samples': profiler.samples})
+        return Response(profiler.report(request.args.get('limit', type=int)), mimetype='text/plain')
+    except Exception as e:
+        logger.error(f"Error in profiler route: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/reset_game', methods=['POST'])
 def reset_game():
     try:
-        game.reset_word_positions()
-        # Reset additional game state if needed
-        game.mask_color = None
-        game.gold_achieved = False
-        game.grabbed_word = None
-        game.finger_in_box = {element: False for element in game.squares}
-        game.last_sound_time = {element: 0 for element in game.squares}
+        session_id = get_session_id()
+        if not sessions.store.exists(session_id):
+            # A session without state has nothing to reset, and saving one here would make the
+            # scheduler treat it as already playing and admit it past SCHEDULER_MAX_ACTIVE_SESSIONS
+            return jsonify({'success': True, 'message': 'Game reset successfully'})
+        with sessions.session(session_id) as game:
+            game.reset_word_positions()
+            # Reset additional game state if needed
+            game.mask_color = None
+            game.gold_achieved = False
+            game.grabbed_word = None
+            game.finger_in_box = {element: False for element in game.squares}
+            game.last_sound_time = {element: 0 for element in game.squares}
         
         return jsonify({
             'success': True,
@@ -0,0 +1,321 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from http.cookiejar import CookieJar
+
+import cv2
+import numpy as np
+
+from frame_codec import CODECS, available_codecs
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ['decode', 'motion', 'hands', 'segmentation', 'inference', 'game_logic', 'mask', 'overlay',
+          'landmarks', 'emoji', 'encode', 'total']
+ELEMENTS = {'fire': '🔥', 'air': '💨', 'water': '🌊', 'earth': '🌱'}
+
+def synthetic_frames(count, width=640, height=480):
+    # A moving bright blob over a slowly shifting gradient, so motion-dependent stages do real work
+    xs = np.linspace(0, 255, width, dtype=np.float32)
+    for i in range(count):
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:] = ((xs + i * 4) % 256).astype(np.uint8)[None, :, None]
+        center = (int(width / 2 + width / 3 * np.sin(i / 15)), int(height / 2 + height / 4 * np.cos(i / 15)))
+        cv2.circle(frame, center, 40, (200, 180, 160), -1)
+        yield frame
+
+def video_frames(path, count):
+    cap = cv2.VideoCapture(path)
+    try:
+        read = 0
+        while count is None or read < count:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            read += 1
+            yield frame
+    finally:
+        cap.release()
+
+def directory_frames(path, count):
+    files = sorted(glob.glob(os.path.join(path, '*.jpg')) + glob.glob(os.path.join(path, '*.jpeg')) +
+                   glob.glob(os.path.join(path, '*.png')))
+    for file in files[:count]:
+        frame = cv2.imread(file, cv2.IMREAD_COLOR)
+        if frame is not None:
+            yield frame
+
+def load_frames(args):
+    # Frames are JPEG-encoded up front so the benchmark measures the server path, not the source
+    if args.video:
+        source = video_frames(args.video, args.frames)
+    elif args.images:
+        source = directory_frames(args.images, args.frames)
+    else:
+        source = synthetic_frames(args.frames or 300)
+    frames = []
+    for frame in source:
+        if args.flip:
+            frame = cv2.flip(frame, 1)
+        ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, args.upload_quality])
+        if ok:
+            frames.append(encoded.tobytes())
+    if not frames:
+        raise SystemExit("No frames could be loaded")
+    return frames
+
+def percentiles(samples):
+    # None when there is nothing to measure, e.g. every request against the server failed
+    values = np.asarray(samples, dtype=np.float64)
+    if values.size == 0:
+        return None
+    return {'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95)),
+            'p99': float(np.percentile(values, 99)), 'count': int(values.size)}
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def wait_for_pipelines(app):
+    # Timed frames must not include model construction; the cold start is reported separately
+    app.pipeline_pool.start()
+    app.pipeline_pool.wait_ready()
+    return app.pipeline_pool.status()
+
+def run_inprocess(args, frames):
+    # Import late so the pool size from the command line is picked up
+    os.environ['PIPELINE_POOL_SIZE'] = str(args.pool_size)
+    import app
+    cold_start = wait_for_pipelines(app)
+
+    game = app.WebElementGame(app.pipeline_pool)
+    game.quality.enabled = args.adaptive
+    if args.mask:
+        game.mask_color = game.squares[ELEMENTS[args.mask]]['color']
+
+    stage_samples = {}
+    errors = 0
+    for i in range(args.warmup):
+        game.process_frame_bytes(frames[i % len(frames)], args.mode, args.include_mask)
+    game.hand_gate.inferences = game.hand_gate.reuses = 0
+    game.hand_roi.roi_frames = game.hand_roi.full_frames = 0
+
+    allocated_kb = []
+    arena_allocations = []
+    if args.trace_allocations:
+        # numpy and OpenCV outputs are traced; the peak above the frame's starting point is
+        # what the frame allocated transiently on top of the buffers it reuses
+        tracemalloc.start()
+    start = time.perf_counter()
+    for image_data in frames:
+        if args.trace_allocations:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        result = game.process_frame_bytes(image_data, args.mode, args.include_mask)
+        if args.trace_allocations:
+            allocated_kb.append((tracemalloc.get_traced_memory()[1] - baseline) / 1024)
+        arena_allocations.append(game.arena.frame_allocations)
+        if not result['success']:
+            errors += 1
+            continue
+        for stage, ms in result['timings'].items():
+            stage_samples.setdefault(stage, []).append(ms)
+    elapsed = time.perf_counter() - start
+    if args.trace_allocations:
+        tracemalloc.stop()
+
+    return {
+        'mode': 'inprocess',
+        'frames': len(frames),
+        'errors': errors,
+        'fps': len(frames) / elapsed,
+        'stages': {stage: percentiles(stage_samples[stage]) for stage in STAGES if stage in stage_samples},
+        'allocations': {
+            'arena_buffers': len(game.arena),
+            'arena_mb': game.arena.nbytes() / (1024 * 1024),
+            'arena_allocations_per_frame': percentiles(arena_allocations),
+            'traced_peak_kb_per_frame': percentiles(allocated_kb) if allocated_kb else None
+        },
+        'hand_skip_rate': game.hand_gate.skip_rate,
+        'hand_roi_rate': game.hand_roi.roi_rate if game.hand_roi.enabled else None,
+        'codec': game.codec.name,
+        'codecs_available': available_codecs(),
+        'cold_start': cold_start,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def make_client(args):
+    # Each client gets its own cookie jar, and so its own game session
+    if args.url:
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+        base = args.url.rstrip('/')
+
+        def post(image_data, query):
+            request = urllib.request.Request(f'{base}/process_frame_binary{query}', data=image_data,
+                                             headers={'Content-Type': 'image/jpeg'})
+            try:
+                with opener.open(request, timeout=30) as response:
+                    response.read()
+                    return response.status
+            except urllib.error.HTTPError as e:
+                return e.code
+        return post
+
+    import app
+    client = app.app.test_client()
+
+    def post(image_data, query):
+        return client.post(f'/process_frame_binary{query}', data=image_data,
+                           content_type='image/jpeg').status_code
+    return post
+
+def run_clients(args, frames):
+    cold_start = None
+    codec = None
+    if not args.url:
+        os.environ['PIPELINE_POOL_SIZE'] = str(args.pool_size)
+        import app
+        cold_start = wait_for_pipelines(app)
+        codec = app.WebElementGame(app.pipeline_pool).codec.name
+    query = '?mode=state' + ('&mask=1' if args.include_mask else '') if args.mode == 'state' else ''
+    latencies = []
+    # 204 is a frame the server scheduler skipped, 503 a session it turned away
+    outcomes = {'errors': 0, 'skipped': 0, 'rejected': 0}
+    lock = threading.Lock()
+
+    def client_loop(index):
+        post = make_client(args)
+        local_latencies = []
+        local_outcomes = dict.fromkeys(outcomes, 0)
+        for i in range(len(frames)):
+            image_data = frames[(i + index) % len(frames)]
+            start = time.perf_counter()
+            try:
+                status = post(image_data, query)
+            except Exception:
+                status = None
+            if status == 200:
+                local_latencies.append((time.perf_counter() - start) * 1000)
+            elif status == 204:
+                local_outcomes['skipped'] += 1
+            elif status == 503:
+                local_outcomes['rejected'] += 1
+            else:
+                local_outcomes['errors'] += 1
+        with lock:
+            latencies.extend(local_latencies)
+            for outcome, count in local_outcomes.items():
+                outcomes[outcome] += count
+
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'mode': 'clients',
+        'clients': args.clients,
+        'frames': len(latencies),
+        'errors': outcomes['errors'],
+        'skipped': outcomes['skipped'],
+        'rejected': outcomes['rejected'],
+        'fps': len(latencies) / elapsed,
+        'fps_per_client': len(latencies) / elapsed / args.clients,
+        'stages': {'request': percentiles(latencies)},
+        'codec': codec,
+        'codecs_available': available_codecs(),
+        'cold_start': cold_start,
+        'peak_rss_mb': peak_rss_mb() if not args.url else None
+    }
+
+def print_report(report):
+    print(f"{report['mode']}: {report['frames']} frames, {report['errors']} errors, {report['fps']:.1f} fps")
+    if 'fps_per_client' in report:
+        print(f"  {report['clients']} clients, {report['fps_per_client']:.1f} fps per client, "
+              f"{report['skipped']} frames skipped, {report['rejected']} rejected")
+    print(f"  {'stage':<14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'n':>8}")
+    for stage, stats in report['stages'].items():
+        if stats is None:
+            print(f"  {stage:<14}{'-':>10}{'-':>10}{'-':>10}{0:>8}")
+            continue
+        print(f"  {stage:<14}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}{stats['count']:>8}")
+    allocations = report.get('allocations')
+    if allocations:
+        per_frame = allocations['arena_allocations_per_frame']
+        print(f"  frame arena: {allocations['arena_buffers']} buffers, {allocations['arena_mb']:.1f} MB, "
+              f"{per_frame['p50']:.0f} allocations per frame (p50), {max(per_frame['p99'], 0):.0f} (p99)")
+        if allocations['traced_peak_kb_per_frame']:
+            traced = allocations['traced_peak_kb_per_frame']
+            print(f"  allocated per frame: {traced['p50']:.0f} KB (p50), {traced['p95']:.0f} KB (p95)")
+    if report.get('hand_skip_rate') is not None:
+        print(f"  hand tracking skipped on {report['hand_skip_rate'] * 100:.1f}% of frames")
+    if report.get('hand_roi_rate') is not None:
+        print(f"  hand tracking ran on an ROI crop for {report['hand_roi_rate'] * 100:.1f}% of runs")
+    if report.get('codec'):
+        print(f"  codec {report['codec']} (available: {', '.join(report['codecs_available'])})")
+    cold_start = report.get('cold_start')
+    if cold_start and cold_start['cold_start_seconds'] is not None:
+        print(f"  cold start {cold_start['cold_start_seconds']:.2f}s for {cold_start['pipelines_total']} pipelines "
+              f"(build {cold_start['startup_seconds']['build']:.2f}s, "
+              f"warm-up {cold_start['startup_seconds']['warmup']:.2f}s)")
+    if report.get('peak_rss_mb') is not None:
+        print(f"  peak RSS {report['peak_rss_mb']:.1f} MB")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay frames through WebElementGame.process_frame")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--video', help="Video file to replay")
+    source.add_argument('--images', help="Directory of JPEG/PNG frames to replay")
+    parser.add_argument('--frames', type=int, help="Number of frames (default: all, or 300 synthetic)")
+    parser.add_argument('--flip', action='store_true', help="Mirror frames like the webcam client")
+    parser.add_argument('--upload-quality', type=int, default=80, help="JPEG quality of replayed uploads")
+    parser.add_argument('--mode', choices=['image', 'state'], default='image')
+    parser.add_argument('--include-mask', action='store_true', help="Request the mask in state mode")
+    parser.add_argument('--mask', choices=sorted(ELEMENTS),
+                        help="Start with this element's mask active so segmentation runs")
+    parser.add_argument('--adaptive', action='store_true', help="Leave the adaptive quality controller on")
+    parser.add_argument('--pool-size', type=int, default=1, help="MediaPipe pipelines in the pool")
+    parser.add_argument('--warmup', type=int, default=10, help="Untimed frames before measuring")
+    parser.add_argument('--clients', type=int, default=0,
+                        help="Drive the Flask app with this many concurrent clients instead")
+    parser.add_argument('--url', help="Base URL of a running server for --clients (default: in-process)")
+    parser.add_argument('--trace-allocations', action='store_true',
+                        help="Measure the memory each frame allocates with tracemalloc (slows frames down)")
+    parser.add_argument('--codec', choices=['auto'] + sorted(CODECS),
+                        help="Frame codec to benchmark (sets FRAME_CODEC; not with --url, where the server picks)")
+    parser.add_argument('--json', help="Also write the report to this file")
+    args = parser.parse_args(argv)
+    if args.codec and args.url:
+        parser.error("--codec has no effect on a remote server, set FRAME_CODEC there")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.codec:
+        # Before app is imported, it reads FRAME_CODEC once
+        os.environ['FRAME_CODEC'] = args.codec
+    frames = load_frames(args)
+    report = run_clients(args, frames) if args.clients else run_inprocess(args, frames)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import logging
+import os
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+EMOJI_FONT_PATH = os.environ.get('EMOJI_FONT_PATH', "seguiemj.ttf")
+# Tried after EMOJI_FONT_PATH; the Docker image installs the font here
+EMOJI_FONT_FALLBACKS = ("/usr/share/fonts/truetype/seguiemj.ttf",)
+EMOJI_FONT_SIZE = 48
+
+@lru_cache(maxsize=None)
+def load_emoji_font(size=EMOJI_FONT_SIZE, path=EMOJI_FONT_PATH):
+    # Shared by every game instance, the font object is read-only once loaded.
+    # Returns None when no emoji font can be found so the game still starts.
+    logger.debug("Loading emoji font")
+    for candidate in (path,) + EMOJI_FONT_FALLBACKS:
+        try:
+            font = ImageFont.truetype(candidate, size)
+            logger.debug(f"Emoji font loaded from {candidate}")
+            return font
+        except OSError:
+            continue
+    logger.warning(f"Emoji font {path} not found, drawing elements as plain markers")
+    return None
+
+class EmojiSpriteCache:
+    # Each emoji is rasterized once into a small tile, then alpha-blended straight
+    # into numpy frames so no font rendering or PIL image copy happens per frame
+    def __init__(self, elements, font=None, fill=(255, 255, 255), size=EMOJI_FONT_SIZE):
+        self.font = font or load_emoji_font(size)
+        self.fill = fill
+        self.size = size
+        self.sprites = {element: self._rasterize(element) for element in elements}
+        # Size of a scratch buffer that fits any tile, for blend(..., scratch=)
+        self.max_tile_shape = (max(sprite['inverse_alpha'].shape[0] for sprite in self.sprites.values()),
+                               max(sprite['inverse_alpha'].shape[1] for sprite in self.sprites.values()), 3)
+
+    def _rasterize(self, text):
+        if self.font is None:
+            # No emoji font: a filled disc of the glyph size marks the word position
+            radius = self.size // 2
+            left, top = -radius, -radius
+            coverage = Image.new("L", (2 * radius, 2 * radius), 0)
+            ImageDraw.Draw(coverage).ellipse((0, 0, 2 * radius - 1, 2 * radius - 1), fill=255)
+        else:
+            # Offsets are relative to the glyph center, matching draw.text(..., anchor="mm")
+            left, top, right, bottom = self.font.getbbox(text, anchor="mm")
+            width, height = max(1, right - left), max(1, bottom - top)
+            coverage = Image.new("L", (width, height), 0)
+            ImageDraw.Draw(coverage).text((-left, -top), text, font=self.font, fill=255, anchor="mm")
+
+        alpha = np.asarray(coverage, dtype=np.uint16)[..., None]
+        color = np.array(self.fill, dtype=np.uint16)
+        return {
+            'offset': (left, top),
+            'premultiplied': color * alpha,  # fill * alpha, 0..255*255
+            'inverse_alpha': 255 - alpha
+        }
+
+    def nbytes(self):
+        return sum(sprite['premultiplied'].nbytes + sprite['inverse_alpha'].nbytes
+                   for sprite in self.sprites.values())
+
+    def blend(self, image_rgb, element, center, scratch=None):
+        sprite = self.sprites[element]
+        tile_height, tile_width = sprite['inverse_alpha'].shape[:2]
+        x0, y0 = int(center[0]) + sprite['offset'][0], int(center[1]) + sprite['offset'][1]
+
+        # Clip the tile against the frame edges
+        frame_height, frame_width = image_rgb.shape[:2]
+        left, top = max(0, -x0), max(0, -y0)
+        right, bottom = min(tile_width, frame_width - x0), min(tile_height, frame_height - y0)
+        if left >= right or top >= bottom:
+            return
+
+        roi = image_rgb[y0 + top:y0 + bottom, x0 + left:x0 + right]
+        # uint16 working copy, in the caller's scratch buffer when given one
+        out = scratch[:bottom - top, :right - left] if scratch is not None else None
+        blended = np.multiply(roi, sprite['inverse_alpha'][top:bottom, left:right], out=out, dtype=np.uint16)
+        blended += sprite['premultiplied'][top:bottom, left:right]
+        blended += 127
+        blended //= 255
+        roi[:] = blended
+
+    def draw(self, image_rgb, word_positions, scratch=None):
+        for element, position in word_positions.items():
+            self.blend(image_rgb, element, position, scratch)
+
+@lru_cache(maxsize=None)
+def get_sprite_cache(elements, size=EMOJI_FONT_SIZE):
+    # One cache per element set is shared by all sessions in the process
+    return EmojiSpriteCache(elements, load_emoji_font(size), size=size)
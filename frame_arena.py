@@ -0,0 +1,57 @@
+import threading
+
+import numpy as np
+
+class FrameArena:
+    # Named scratch buffers that frame stages write into with dst=/out= instead of allocating.
+    # A buffer is only (re)allocated when its shape or dtype changes, and every allocation is
+    # counted so steady-state churn shows up. One arena per session: frames of a session are
+    # serialized, and stages that run side by side use different names.
+    def __init__(self):
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self.allocations = 0
+        self.frame_allocations = 0  # since begin_frame()
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def begin_frame(self):
+        self.frame_allocations = 0
+
+    def _count(self):
+        with self._lock:
+            self.allocations += 1
+            self.frame_allocations += 1
+
+    def get(self, name, shape, dtype=np.uint8):
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(shape, dtype)
+            self._count()
+        return buffer
+
+    def find(self, name):
+        return self._buffers.get(name)
+
+    def adopt(self, name, array):
+        # Keeps an array a library allocated (e.g. a decoder without dst support) for reuse
+        if self._buffers.get(name) is not array:
+            self._buffers[name] = array
+            self._count()
+        return array
+
+    def view(self, name, shape, dtype=np.uint8):
+        # Contiguous view of a flat buffer that only grows, for shapes that change every frame
+        size = int(np.prod(shape))
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(size, dtype)
+            self._count()
+        return buffer[:size].reshape(shape)
+
+    def nbytes(self):
+        # Called from other sessions' threads while this one may add buffers; list() copies the
+        # values in one step under the GIL, iterating the live dict could see it resize
+        return sum(buffer.nbytes for buffer in list(self._buffers.values()))
+
@@ -0,0 +1,155 @@
+import io
+import logging
+
+import cv2
+import numpy as np
+from PIL import Image
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_422
+except ImportError:
+    TurboJPEG = None
+
+logger = logging.getLogger(__name__)
+
+MIMETYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+def _reuse(out, shape):
+    # Returns out when it can hold a frame of this shape, otherwise None
+    if out is not None and out.shape == shape and out.dtype == np.uint8:
+        return out
+    return None
+
+class FrameCodec:
+    # Decodes uploads straight to RGB and encodes RGB frames. decode_rgb() writes into out when
+    # the backend can decode into a caller buffer of the right shape. encode() may convert
+    # the frame in place, so callers must not use it afterwards. Instances keep
+    # scratch buffers and are not meant to be shared between threads.
+    name = None
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def decode_rgb(self, data, out=None):
+        raise NotImplementedError
+
+    def encode(self, image_rgb, quality=95, fmt='jpeg'):
+        raise NotImplementedError
+
+    @staticmethod
+    def mimetype(fmt='jpeg'):
+        return MIMETYPES[fmt]
+
+class OpenCVCodec(FrameCodec):
+    name = 'opencv'
+
+    def decode_rgb(self, data, out=None):
+        buffer = np.frombuffer(data, np.uint8)
+        if hasattr(cv2, 'IMREAD_COLOR_RGB'):
+            frame = cv2.imdecode(buffer, cv2.IMREAD_COLOR_RGB)
+            if frame is None:
+                raise ValueError("Could not decode frame image")
+            return frame
+        frame = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("Could not decode frame image")
+        # imdecode has no dst, so swap channels in place rather than copying into out
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+
+    def encode(self, image_rgb, quality=95, fmt='jpeg'):
+        cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR, dst=image_rgb)
+        if fmt == 'webp':
+            ok, encoded = cv2.imencode('.webp', image_rgb, [cv2.IMWRITE_WEBP_QUALITY, quality])
+        else:
+            ok, encoded = cv2.imencode('.jpg', image_rgb, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise ValueError("Could not encode frame image")
+        return encoded.tobytes()
+
+class PILCodec(FrameCodec):
+    name = 'pil'
+
+    def __init__(self):
+        # Output buffer reused across frames
+        self._output = io.BytesIO()
+
+    def decode_rgb(self, data, out=None):
+        with Image.open(io.BytesIO(data)) as image:
+            image = image.convert('RGB')
+            dst = _reuse(out, (image.height, image.width, 3))
+            if dst is None:
+                return np.asarray(image).copy()
+            dst[:] = np.asarray(image)
+            return dst
+
+    def encode(self, image_rgb, quality=95, fmt='jpeg'):
+        self._output.seek(0)
+        self._output.truncate()
+        Image.fromarray(image_rgb).save(self._output, format='WEBP' if fmt == 'webp' else 'JPEG',
+                                        quality=quality)
+        return self._output.getvalue()
+
+class TurboJPEGCodec(FrameCodec):
+    # libjpeg-turbo through PyTurboJPEG, when both are installed
+    name = 'turbojpeg'
+    _library = None
+
+    @classmethod
+    def available(cls):
+        if TurboJPEG is None:
+            return False
+        if cls._library is None:
+            try:
+                cls._library = TurboJPEG()
+            except Exception as e:
+                logger.warning(f"libjpeg-turbo unavailable: {e}")
+                return False
+        return True
+
+    def __init__(self):
+        if not self.available():
+            raise RuntimeError("PyTurboJPEG/libjpeg-turbo is not installed")
+        self.jpeg = self._library
+        self._output = None
+        self._webp = OpenCVCodec()
+
+    def decode_rgb(self, data, out=None):
+        width, height = self.jpeg.decode_header(data)[:2]
+        dst = _reuse(out, (height, width, 3))
+        if dst is not None:
+            try:
+                return self.jpeg.decode(data, pixel_format=TJPF_RGB, dst=dst)
+            except TypeError:
+                # PyTurboJPEG < 1.7 has no dst argument
+                pass
+        return self.jpeg.decode(data, pixel_format=TJPF_RGB)
+
+    def encode(self, image_rgb, quality=95, fmt='jpeg'):
+        if fmt == 'webp':
+            return self._webp.encode(image_rgb, quality, fmt)
+        if not hasattr(self.jpeg, 'buffer_size'):
+            # PyTurboJPEG < 1.7 has neither buffer_size() nor a dst argument
+            return self.jpeg.encode(image_rgb, quality=quality, pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_422)
+        # libjpeg-turbo writes up to tjBufSize() bytes into a caller buffer, so size it from that
+        size = self.jpeg.buffer_size(image_rgb, TJSAMP_422)
+        if self._output is None or len(self._output) < size:
+            self._output = bytearray(size)
+        _, length = self.jpeg.encode(image_rgb, quality=quality, pixel_format=TJPF_RGB,
+                                     jpeg_subsample=TJSAMP_422, dst=self._output)
+        return bytes(memoryview(self._output)[:length])
+
+CODECS = {codec.name: codec for codec in (OpenCVCodec, PILCodec, TurboJPEGCodec)}
+
+def available_codecs():
+    return [name for name, codec in CODECS.items() if codec.available()]
+
+def get_codec(name='auto'):
+    # 'auto' picks libjpeg-turbo when installed and OpenCV otherwise
+    if name == 'auto':
+        name = 'turbojpeg' if TurboJPEGCodec.available() else 'opencv'
+    codec = CODECS.get(name)
+    if codec is None or not codec.available():
+        logger.warning(f"Frame codec '{name}' unavailable, using opencv")
+        codec = OpenCVCodec
+    return codec()
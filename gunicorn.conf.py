@@ -0,0 +1,54 @@
+# Production serving: gunicorn -c gunicorn.conf.py app:app
+# Every worker process builds its own MediaPipe pipeline pool; game state is shared
+# through STATE_STORE so any worker can serve any frame of a session.
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Threads keep websocket streams from pinning whole workers
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+
+# Split the cores between workers instead of giving each worker a full pool
+os.environ.setdefault('PIPELINE_POOL_SIZE', str(max(1, multiprocessing.cpu_count() // workers)))
+
+# In-process state would diverge between workers, so default to the shared memory store
+if workers > 1:
+    os.environ.setdefault('STATE_STORE', 'shm:///dev/shm/elements-state')
+
+# /readyz answers for every worker: each one publishes its pipeline status under WORKER_STATUS_DIR
+os.environ['WORKER_COUNT'] = str(workers)
+if workers > 1:
+    os.environ.setdefault('WORKER_STATUS_DIR', '/dev/shm/elements-workers')
+    # Each worker has its own registry; /metrics sums the per-worker files written here
+    os.environ.setdefault('METRICS_DIR', '/dev/shm/elements-metrics')
+
+# Import the app once in the master so libraries, fonts and sprite tiles are shared by the
+# workers after fork. MediaPipe graphs own threads that don't survive fork, so with preloading
+# the pipelines are always deferred and each worker builds and warms its own after it starts.
+preload_app = os.environ.get('PRELOAD_APP', '1') == '1'
+if preload_app:
+    os.environ['MODEL_INIT'] = 'deferred'
+
+def on_starting(server):
+    # Statuses and counters left by a previous run would count towards this one
+    from worker_status import WorkerStatusBoard
+    WorkerStatusBoard(os.environ.get('WORKER_STATUS_DIR')).clear()
+    if os.environ.get('METRICS_DIR'):
+        from metrics import MultiProcessCollector
+        MultiProcessCollector(os.environ['METRICS_DIR']).clear()
+
+def child_exit(server, worker):
+    from worker_status import WorkerStatusBoard
+    WorkerStatusBoard(os.environ.get('WORKER_STATUS_DIR')).remove(worker.pid)
+
+def post_worker_init(worker):
+    # Warm up in the background so the worker answers /healthz while /readyz reports 503
+    import app
+    app.pipeline_pool.start()
+    if app.metrics_collector is not None:
+        app.metrics_collector.start()
@@ -0,0 +1,323 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import Counter as StackCounter
+
+from worker_status import pid_alive
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond stages up to slow full frames
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def snapshot(self):
+        # JSON-able copy of the raw values, merged across workers by MultiProcessCollector
+        with self._lock:
+            values = [[list(key), value] for key, value in self._values.items()]
+        return {'kind': self.kind, 'documentation': self.documentation, 'labelnames': list(self.labelnames),
+                'values': values}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name}{labels} {value}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in items]
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, function=None, aggregate='sum'):
+        super().__init__(name, documentation, labelnames, registry)
+        # Optional callback sampled at scrape time instead of set() on the hot path
+        self.function = function
+        # How live workers' values combine under MultiProcessCollector: 'sum' or 'max'
+        self.aggregate = aggregate
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.function is not None:
+            return [(self.name, '', self.function())]
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in items]
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        if self.function is not None:
+            snapshot['values'] = [[[], self.function()]]
+        snapshot['aggregate'] = self.aggregate
+        return snapshot
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (non-cumulative) plus +Inf, then sum
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                samples.append((f'{self.name}_bucket', _format_labels(self.labelnames, key, [('le', le)]),
+                                cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        # Copy the bucket lists under the lock, observe() keeps updating them in place
+        with self._lock:
+            snapshot['values'] = [[list(key), [list(counts), total]] for key, (counts, total) in self._values.items()]
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+REGISTRY = Registry()
+
+class MultiProcessCollector:
+    # Each worker process writes its registry to <path>/<pid>-<start>.json, every interval seconds
+    # and whenever it answers a scrape, and a scrape merges every file. Counters and histograms
+    # keep the files of dead workers, so totals never go backwards when a worker is recycled;
+    # gauges only count live workers. Clear the directory when the server starts.
+    def __init__(self, path, registry=None, interval=5.0):
+        self.path = path
+        self.registry = registry if registry is not None else REGISTRY
+        self.interval = interval
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def start(self):
+        # Call in each worker after fork; the writer thread would not survive the fork
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._file = os.path.join(self.path, f'{self._pid}-{time.time_ns()}.json')
+        threading.Thread(target=self._run, name='metrics-writer', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self.write()
+            time.sleep(self.interval)
+
+    def write(self):
+        self.start()
+        temporary = self._file + '.tmp'
+        try:
+            with open(temporary, 'w') as f:
+                json.dump(self.registry.snapshot(), f)
+            os.replace(temporary, self._file)
+        except OSError as e:
+            logger.warning(f"Could not write metrics snapshot: {e}")
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+    def _snapshots(self):
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.path, name)) as f:
+                    snapshot = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            yield pid_alive(int(name.split('-', 1)[0])), snapshot
+
+    def collect(self):
+        # Rebuilds the merged metrics in a throwaway registry, so rendering stays in Metric
+        merged = Registry()
+        metrics = {}
+        for alive, snapshot in self._snapshots():
+            for name, data in snapshot.items():
+                if data['kind'] == 'gauge' and not alive:
+                    continue
+                metric = metrics.get(name)
+                if metric is None:
+                    if data['kind'] == 'counter':
+                        metric = Counter(name, data['documentation'], data['labelnames'], registry=merged)
+                    elif data['kind'] == 'gauge':
+                        metric = Gauge(name, data['documentation'], data['labelnames'], registry=merged,
+                                       aggregate=data.get('aggregate', 'sum'))
+                    else:
+                        metric = Histogram(name, data['documentation'], data['labelnames'], registry=merged,
+                                           buckets=data['buckets'])
+                    metrics[name] = metric
+                for key, value in data['values']:
+                    key = tuple(key)
+                    current = metric._values.get(key)
+                    if current is None:
+                        metric._values[key] = value
+                    elif data['kind'] == 'histogram':
+                        metric._values[key] = [[a + b for a, b in zip(current[0], value[0])],
+                                               current[1] + value[1]]
+                    elif data['kind'] == 'gauge' and metric.aggregate == 'max':
+                        metric._values[key] = max(current, value)
+                    else:
+                        metric._values[key] = current + value
+        return merged
+
+    def render(self):
+        # Refresh this worker's own file first, so the answering worker is never stale
+        self.write()
+        return self.collect().render()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class SamplingProfiler:
+    # Opt-in stack sampler: a background thread snapshots every thread's stack at a fixed
+    # interval and counts collapsed stacks. Nothing runs on the hot path while it is stopped.
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = StackCounter()
+        self.samples = 0
+        self.started_at = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        with self._lock:
+            if self.running:
+                return False
+            if interval:
+                self.interval = interval
+            self.stacks.clear()
+            self.samples = 0
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return False
+            self._stop.set()
+            thread = self._thread
+        # Join outside the lock, the sampler takes it for every stack it records
+        thread.join()
+        return True
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = ';'.join(f'{entry.name} ({entry.filename.rsplit("/", 1)[-1]}:{entry.lineno})'
+                                 for entry in traceback.extract_stack(frame))
+                with self._lock:
+                    self.stacks[stack] += 1
+            self.samples += 1
+
+    def report(self, limit=None):
+        # Collapsed-stack format, one "frame;frame;frame count" line per stack (flamegraph.pl compatible).
+        # Copy under the lock, the sampler keeps inserting while it runs.
+        with self._lock:
+            stacks = StackCounter(self.stacks)
+        return '\n'.join(f'{stack} {count}' for stack, count in stacks.most_common(limit)) + '\n'
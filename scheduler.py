@@ -0,0 +1,193 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import Counter
+
+DROPPED_FRAMES_TOTAL = Counter('elements_dropped_frames_total', 'Frames dropped before processing', ['reason'])
+REJECTED_SESSIONS_TOTAL = Counter('elements_rejected_sessions_total',
+                                  'New sessions turned away by admission control')
+
+class LatestFrameSlot:
+    # Single-slot inbox: a new frame replaces one that has not been picked up yet,
+    # so a slow server always works on the freshest frame instead of a growing queue
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, seq, image_data):
+        with self._condition:
+            replaced = self._frame[0] if self._frame else None
+            if replaced is not None:
+                self.dropped += 1
+            self._frame = (seq, image_data)
+            self._condition.notify()
+            return replaced
+
+    def take(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._frame or self._closed)
+            frame, self._frame = self._frame, None
+            return frame
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+class FrameSkipped(Exception):
+    def __init__(self, reason):
+        super().__init__(f"Frame skipped ({reason})")
+        self.reason = reason
+
+class SessionRejected(Exception):
+    pass
+
+class FrameTicket:
+    def __init__(self, session_id, deadline):
+        self.session_id = session_id
+        self.enqueued_at = time.perf_counter()
+        self.deadline = deadline
+        self.state = 'queued'
+        self.reason = None
+        self.event = threading.Event()
+
+class FrameScheduler:
+    # Request threads queue per session and are let through round-robin, one running frame per
+    # session and at most capacity frames at once, so a fast client can't crowd out the others
+    def __init__(self, capacity, queue_depth=2, deadline_ms=500, max_active_sessions=0, active_window=10,
+                 wait_histogram=None, known_session=None):
+        self.capacity = max(1, capacity)
+        self.queue_depth = max(1, queue_depth)
+        self.deadline = deadline_ms / 1000
+        self.max_active_sessions = max_active_sessions or self.capacity * 4
+        self.active_window = active_window
+        # Histogram with a 'stage' label that records queue time as stage='queue'
+        self.wait_histogram = wait_histogram
+        # Optional session_id -> bool telling whether the session already plays elsewhere, e.g. it
+        # has state in a store shared by several workers. Such sessions are admitted even while
+        # saturated, since this scheduler only counts the sessions it has seen itself.
+        self.known_session = known_session
+        self._queues = {}  # session_id -> deque of tickets, in arrival order
+        # session_id -> turn it was last served in. Kept while the session is active, so a
+        # client with one frame in flight keeps its place between frames.
+        self._served = {}
+        self._turn = 0
+        self._running = set()
+        self._active = {}  # session_id -> last frame time
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def running(self):
+        with self._lock:
+            return len(self._running)
+
+    @property
+    def active_sessions(self):
+        with self._lock:
+            return len(self._active)
+
+    def _saturated_locked(self):
+        if len(self._active) >= self.max_active_sessions:
+            return True
+        # Every pipeline busy and a full backlog already waiting behind them
+        backlog = sum(len(queue) for queue in self._queues.values())
+        return len(self._running) >= self.capacity and backlog >= self.capacity * self.queue_depth
+
+    def _is_known(self, session_id):
+        # Looked up before taking the lock, as it may read a shared store; only sessions
+        # this scheduler doesn't count as active yet need it
+        return (self.known_session is not None and session_id not in self._active and
+                self.known_session(session_id))
+
+    def _admit_locked(self, session_id, now, known=False):
+        for active_id, last_seen in list(self._active.items()):
+            if now - last_seen > self.active_window and active_id not in self._running:
+                del self._active[active_id]
+                self._served.pop(active_id, None)
+        if session_id not in self._active and not known and self._saturated_locked():
+            REJECTED_SESSIONS_TOTAL.inc()
+            raise SessionRejected("Server is at capacity, try again shortly")
+        self._active[session_id] = now
+
+    def admit(self, session_id):
+        # Raises SessionRejected for a session that isn't active yet while capacity is saturated
+        known = self._is_known(session_id)
+        with self._lock:
+            self._admit_locked(session_id, time.perf_counter(), known)
+
+    def _skip_locked(self, ticket, reason):
+        ticket.state = 'skipped'
+        ticket.reason = reason
+        DROPPED_FRAMES_TOTAL.inc(reason=reason)
+        ticket.event.set()
+
+    def _dispatch_locked(self, now):
+        while len(self._running) < self.capacity:
+            waiting = []
+            for session_id, queue in list(self._queues.items()):
+                if session_id in self._running:
+                    continue
+                while queue and queue[0].deadline < now:
+                    self._skip_locked(queue.popleft(), 'deadline')
+                if not queue:
+                    del self._queues[session_id]
+                    continue
+                waiting.append(session_id)
+            if not waiting:
+                return
+            # The session served longest ago goes next (never served first, in arrival order),
+            # so sending several frames at once doesn't buy a bigger share
+            session_id = min(waiting, key=lambda session_id: self._served.get(session_id, 0))
+            ticket = self._queues[session_id].popleft()
+            self._turn += 1
+            self._served[session_id] = self._turn
+            self._running.add(ticket.session_id)
+            ticket.state = 'granted'
+            ticket.event.set()
+
+    def _release(self, session_id):
+        with self._lock:
+            self._running.discard(session_id)
+            if session_id in self._queues and not self._queues[session_id]:
+                del self._queues[session_id]
+            self._dispatch_locked(time.perf_counter())
+
+    @contextmanager
+    def slot(self, session_id):
+        # Yields the time the frame spent queued in milliseconds once it may run.
+        # Raises FrameSkipped when a newer frame replaced it or its deadline passed first.
+        now = time.perf_counter()
+        ticket = FrameTicket(session_id, now + self.deadline)
+        known = self._is_known(session_id)
+        with self._lock:
+            self._admit_locked(session_id, now, known)
+            queue = self._queues.setdefault(session_id, deque())
+            if len(queue) >= self.queue_depth:
+                self._skip_locked(queue.popleft(), 'replaced')
+            queue.append(ticket)
+            self._dispatch_locked(now)
+
+        if not ticket.event.wait(max(0, ticket.deadline - time.perf_counter())):
+            with self._lock:
+                if ticket.state == 'queued':
+                    self._queues[session_id].remove(ticket)
+                    self._skip_locked(ticket, 'deadline')
+        if ticket.state != 'granted':
+            raise FrameSkipped(ticket.reason)
+
+        wait_ms = (time.perf_counter() - ticket.enqueued_at) * 1000
+        if self.wait_histogram is not None:
+            self.wait_histogram.observe(wait_ms / 1000, stage='queue')
+        try:
+            yield wait_ms
+        finally:
+            self._release(session_id)
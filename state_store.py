@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class StateStore:
+    # Per-session game state shared by every worker. States are plain JSON-able dicts;
+    # lock() serializes frames of one session across threads and processes.
+    def load(self, session_id):
+        raise NotImplementedError
+
+    def save(self, session_id, state, ttl):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def exists(self, session_id):
+        return self.load(session_id) is not None
+
+    @contextmanager
+    def lock(self, session_id):
+        yield
+
+    def sweep(self):
+        # Drops expired sessions for backends that don't expire keys on their own
+        pass
+
+class InProcessStore(StateStore):
+    # Default for a single process; states are stored serialized so callers never share objects
+    def __init__(self):
+        self._states = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def load(self, session_id):
+        with self._guard:
+            entry = self._states.get(session_id)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self._states[session_id]
+                return None
+            return json.loads(entry[0])
+
+    def save(self, session_id, state, ttl):
+        with self._guard:
+            self._states[session_id] = (json.dumps(state), time.time() + ttl)
+
+    def delete(self, session_id):
+        with self._guard:
+            self._states.pop(session_id, None)
+            self._locks.pop(session_id, None)
+
+    @contextmanager
+    def lock(self, session_id):
+        with self._guard:
+            lock = self._locks.setdefault(session_id, threading.Lock())
+        with lock:
+            yield
+
+    def sweep(self):
+        now = time.time()
+        with self._guard:
+            for session_id in [key for key, (_, expires) in self._states.items() if expires < now]:
+                del self._states[session_id]
+            # Locks of expired sessions and of sessions that never saved, unless a frame holds one
+            for session_id in [key for key, lock in self._locks.items()
+                               if key not in self._states and not lock.locked()]:
+                del self._locks[session_id]
+
+class SharedMemoryStore(StateStore):
+    # One JSON file per session on a tmpfs such as /dev/shm, guarded by flock, so forked
+    # workers on the same host share state without a server process
+    def __init__(self, path='/dev/shm/elements-state'):
+        if fcntl is None:
+            raise RuntimeError("SharedMemoryStore needs fcntl (POSIX)")
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, session_id, suffix='.json'):
+        return os.path.join(self.path, session_id + suffix)
+
+    def load(self, session_id):
+        try:
+            with open(self._file(session_id)) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry['expires'] < time.time():
+            self.delete(session_id)
+            return None
+        return entry['state']
+
+    def save(self, session_id, state, ttl):
+        # Write then rename so readers never see a partial file
+        temporary = self._file(session_id, f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(temporary, 'w') as f:
+            json.dump({'state': state, 'expires': time.time() + ttl}, f)
+        os.replace(temporary, self._file(session_id))
+
+    def delete(self, session_id):
+        # Lock files are left to sweep() so a lock held by another worker is never unlinked
+        try:
+            os.remove(self._file(session_id))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def lock(self, session_id):
+        with open(self._file(session_id, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def sweep(self):
+        now = time.time()
+        # State files first, so a session that expires now has its lock file swept in the same pass
+        for name in sorted(os.listdir(self.path), key=lambda name: name.endswith('.lock')):
+            if name.endswith('.json'):
+                session_id = name[:-len('.json')]
+                if self.load(session_id) is None:
+                    logger.debug(f"Swept expired session {session_id}")
+            elif name.endswith('.lock'):
+                # Lock files of sessions whose state has expired or was never written
+                if not os.path.exists(self._file(name[:-len('.lock')])):
+                    try:
+                        if now - os.path.getmtime(os.path.join(self.path, name)) > 60:
+                            os.remove(os.path.join(self.path, name))
+                    except FileNotFoundError:
+                        pass
+
+class RedisStore(StateStore):
+    # Any redis-py compatible client: get, set(ex=), delete and lock(name, timeout=...)
+    def __init__(self, client, prefix='elements:session:', lock_timeout=10):
+        self.client = client
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+
+    def load(self, session_id):
+        raw = self.client.get(self.prefix + session_id)
+        return json.loads(raw) if raw is not None else None
+
+    def save(self, session_id, state, ttl):
+        self.client.set(self.prefix + session_id, json.dumps(state), ex=max(1, int(ttl)))
+
+    def delete(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+    @contextmanager
+    def lock(self, session_id):
+        with self.client.lock(self.prefix + session_id + ':lock', timeout=self.lock_timeout):
+            yield
+
+class LocalRedis:
+    # In-memory stand-in for the subset of the redis-py client RedisStore uses
+    def __init__(self):
+        self._data = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def get(self, key):
+        with self._guard:
+            entry = self._data.get(key)
+            if entry is None or (entry[1] is not None and entry[1] < time.time()):
+                self._data.pop(key, None)
+                return None
+            return entry[0]
+
+    def set(self, key, value, ex=None):
+        with self._guard:
+            self._data[key] = (value.encode() if isinstance(value, str) else value,
+                               time.time() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        with self._guard:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def lock(self, name, timeout=None):
+        with self._guard:
+            return self._locks.setdefault(name, threading.Lock())
+
+def create_store(url=None):
+    # memory:// (default), shm:///dev/shm/elements-state, or redis://host:port/db
+    url = url or 'memory://'
+    scheme = urlparse(url).scheme
+    if scheme == 'memory':
+        return InProcessStore()
+    if scheme == 'shm':
+        return SharedMemoryStore(urlparse(url).path or '/dev/shm/elements-state')
+    if scheme in ('redis', 'rediss', 'unix'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("STATE_STORE uses redis but the redis package is not installed")
+        return RedisStore(redis.Redis.from_url(url))
+    raise ValueError(f"Unknown state store URL: {url}")
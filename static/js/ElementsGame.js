@@ -1,5 +1,76 @@
 // Wrap the entire component in an IIFE (Immediately Invoked Function Expression)
 window.ElementsGame = (() => {
+    // 'state': the server returns game state and the overlay is drawn here over the local video.
+    // 'image': the server returns the fully composited frame as a JPEG.
+    const RENDER_MODE = 'state';
+
+    // Stream frames over a WebSocket; the HTTP loop is used as a fallback
+    const USE_WEBSOCKET = true;
+    const MAX_IN_FLIGHT = 2;
+    // Reconnect delay after a dropped socket, doubled on each failed attempt
+    const RECONNECT_BASE_MS = 500;
+    const RECONNECT_MAX_MS = 10000;
+
+    // MediaPipe hand landmark connections (mp.solutions.hands.HAND_CONNECTIONS)
+    const HAND_CONNECTIONS = [
+        [0, 1], [1, 2], [2, 3], [3, 4], [0, 5], [5, 6], [6, 7], [7, 8],
+        [5, 9], [9, 10], [10, 11], [11, 12], [9, 13], [13, 14], [14, 15], [15, 16],
+        [13, 17], [0, 17], [17, 18], [18, 19], [19, 20]
+    ];
+
+    const rgb = (color, alpha = 1) => `rgba(${color[0]}, ${color[1]}, ${color[2]}, ${alpha})`;
+
+    // Composite the server's game state over the local video frame, mirrored like the server output
+    const drawGameState = (ctx, video, state, maskBitmap) => {
+        const { width, height } = ctx.canvas;
+        const sx = width / state.width;
+        const sy = height / state.height;
+        const size = state.square_size;
+
+        ctx.save();
+        ctx.translate(width, 0);
+        ctx.scale(-1, 1);
+        ctx.drawImage(video, 0, 0, width, height);
+
+        if (maskBitmap) {
+            ctx.drawImage(maskBitmap, 0, 0, width, height);
+        }
+
+        Object.values(state.squares).forEach(({ position, color }) => {
+            ctx.fillStyle = rgb(color, 0.25);
+            ctx.fillRect(position[0] * sx, position[1] * sy, size * sx, size * sy);
+        });
+        ctx.fillStyle = rgb(state.gold_box.color, 0.25);
+        ctx.fillRect(state.gold_box.position[0] * sx, state.gold_box.position[1] * sy, size * sx, size * sy);
+
+        state.hands.forEach((landmarks) => {
+            ctx.strokeStyle = rgb([255, 0, 0]);
+            ctx.lineWidth = 2;
+            ctx.beginPath();
+            HAND_CONNECTIONS.forEach(([a, b]) => {
+                ctx.moveTo(landmarks[a][0] * width, landmarks[a][1] * height);
+                ctx.lineTo(landmarks[b][0] * width, landmarks[b][1] * height);
+            });
+            ctx.stroke();
+
+            ctx.fillStyle = rgb([0, 255, 0]);
+            landmarks.forEach(([x, y]) => {
+                ctx.beginPath();
+                ctx.arc(x * width, y * height, 4, 0, 2 * Math.PI);
+                ctx.fill();
+            });
+        });
+        ctx.restore();
+
+        // Emojis are drawn unmirrored at their mirrored positions so the glyphs stay readable
+        ctx.font = `${Math.round(48 * sy)}px "Segoe UI Emoji", "Apple Color Emoji", "Noto Color Emoji", sans-serif`;
+        ctx.textAlign = 'center';
+        ctx.textBaseline = 'middle';
+        Object.entries(state.word_positions).forEach(([element, position]) => {
+            ctx.fillText(element, width - position[0] * sx, position[1] * sy);
+        });
+    };
+
     // Component definition
     const ElementsGame = () => {
         const [hasPermission, setHasPermission] = React.useState(false);
@@ -18,6 +89,11 @@ window.ElementsGame = (() => {
         const canvasRef = React.useRef(null);
         const streamRef = React.useRef(null);
         const gameLoopRef = React.useRef(null);
+        const captureCanvasRef = React.useRef(null);
+        const socketRef = React.useRef(null);
+        // Upload settings chosen by the server's quality controller
+        const qualityRef = React.useRef({ upload_width: 640, upload_quality: 0.8 });
+        const lastRttRef = React.useRef(null);
         const [sounds, setSounds] = React.useState({});
 
         const addDebugInfo = (info) => {
@@ -135,15 +211,70 @@ window.ElementsGame = (() => {
             }
         };
 
-        const startGameLoop = React.useCallback(() => {
-            if (!videoRef.current || !canvasRef.current) {
-                addDebugInfo('Video or canvas ref not ready');
-                return;
+        const applyQuality = (quality) => {
+            if (!quality) return;
+            const current = qualityRef.current;
+            if (quality.level !== current.level) {
+                addDebugInfo(`Quality level ${quality.level}: upload ${quality.upload_width}px @ ${quality.upload_quality}`);
             }
+            qualityRef.current = quality;
+        };
 
-            addDebugInfo('Starting game loop');
-            let frameCount = 0;
+        // Grab the current video frame, unmirrored, as a JPEG blob at the negotiated upload size
+        const captureFrame = async () => {
+            const canvas = canvasRef.current;
+            if (!captureCanvasRef.current) {
+                captureCanvasRef.current = document.createElement('canvas');
+            }
+            const { upload_width: uploadWidth, upload_quality: uploadQuality } = qualityRef.current;
+            const tempCanvas = captureCanvasRef.current;
+            const width = Math.min(canvas.width, uploadWidth);
+            const height = Math.round(width * canvas.height / canvas.width);
+            if (tempCanvas.width !== width || tempCanvas.height !== height) {
+                tempCanvas.width = width;
+                tempCanvas.height = height;
+            }
+            const tempContext = tempCanvas.getContext('2d');
             
+            // Draw unmirrored video frame
+            tempContext.drawImage(videoRef.current, 0, 0, width, height);
+            return new Promise((resolve) => {
+                tempCanvas.toBlob(resolve, 'image/jpeg', uploadQuality);
+            });
+        };
+
+        const drawProcessedImage = async (blob) => {
+            const bitmap = await createImageBitmap(blob);
+            if (canvasRef.current) {
+                const canvas = canvasRef.current;
+                const ctx = canvas.getContext('2d');
+                ctx.clearRect(0, 0, canvas.width, canvas.height);
+                
+                // Mirror the final output
+                ctx.save();
+                ctx.scale(-1, 1);
+                ctx.drawImage(bitmap, -canvas.width, 0, canvas.width, canvas.height);
+                ctx.restore();
+            }
+            bitmap.close();
+        };
+
+        const drawStateResult = async (data) => {
+            const maskBitmap = data.state.mask
+                ? await createImageBitmap(await (await fetch(data.state.mask)).blob())
+                : null;
+            if (canvasRef.current && videoRef.current) {
+                drawGameState(canvasRef.current.getContext('2d'), videoRef.current, data.state, maskBitmap);
+            }
+            if (maskBitmap) {
+                maskBitmap.close();
+            }
+        };
+
+        // One HTTP POST per frame; used when WebSockets are unavailable
+        const startHttpLoop = () => {
+            addDebugInfo('Starting HTTP game loop');
+
             const processFrame = async () => {
                 if (!isMounted.current) return;
 
@@ -153,51 +284,50 @@ window.ElementsGame = (() => {
                         return;
                     }
 
-                    const canvas = canvasRef.current;
-                    const context = canvas.getContext('2d');
-                    
-                    // Send unmirrored frame to backend
-                    const tempCanvas = document.createElement('canvas');
-                    tempCanvas.width = canvas.width;
-                    tempCanvas.height = canvas.height;
-                    const tempContext = tempCanvas.getContext('2d');
-                    
-                    // Draw unmirrored video frame
-                    tempContext.drawImage(videoRef.current, 0, 0, canvas.width, canvas.height);
-                    const frameData = tempCanvas.toDataURL('image/jpeg', 0.8);
+                    const frameBlob = await captureFrame();
+                    const sentAt = performance.now();
 
-                    const response = await fetch('/process_frame', {
+                    // Raw JPEG up; either raw JPEG or compact JSON state down
+                    const url = RENDER_MODE === 'state'
+                        ? '/process_frame_binary?mode=state&mask=1'
+                        : '/process_frame_binary';
+                    const headers = {
+                        'Content-Type': 'image/jpeg',
+                    };
+                    if (lastRttRef.current !== null) {
+                        headers['X-Client-RTT'] = lastRttRef.current.toFixed(1);
+                    }
+                    const response = await fetch(url, {
                         method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify({ frame: frameData }),
+                        headers,
+                        body: frameBlob,
                     });
 
-                    if (response.ok) {
+                    if (response.status === 204) {
+                        // Skipped by the server scheduler; keep showing the previous frame
+                    } else if (response.status === 503) {
+                        // Server at capacity: back off before asking again
+                        const retryAfter = Number(response.headers.get('Retry-After') || 5);
+                        addDebugInfo(`Server at capacity, retrying in ${retryAfter}s`);
+                        gameLoopRef.current = setTimeout(
+                            () => { gameLoopRef.current = requestAnimationFrame(processFrame); },
+                            retryAfter * 1000
+                        );
+                        return;
+                    } else if (response.ok && RENDER_MODE === 'state') {
                         const data = await response.json();
-                        if (data.success) {
-                            // Draw the processed image
-                            const img = new Image();
-                            img.onload = () => {
-                                if (canvasRef.current) {
-                                    const ctx = canvasRef.current.getContext('2d');
-                                    ctx.clearRect(0, 0, canvas.width, canvas.height);
-                                    
-                                    // Mirror the final output
-                                    ctx.save();
-                                    ctx.scale(-1, 1);
-                                    ctx.drawImage(img, -canvas.width, 0, canvas.width, canvas.height);
-                                    ctx.restore();
-                                }
-                            };
-                            img.src = data.image;
-
-                            handleSoundEvents(data.sound_events);
-                        } else {
-                            addDebugInfo(`Server processing error: ${data.error}`);
-                        }
+                        await drawStateResult(data);
+                        handleSoundEvents(data.sound_events);
+                        applyQuality(data.quality);
+                    } else if (response.ok) {
+                        await drawProcessedImage(await response.blob());
+                        handleSoundEvents(JSON.parse(response.headers.get('X-Sound-Events') || '[]'));
+                        applyQuality(JSON.parse(response.headers.get('X-Quality') || 'null'));
+                    } else {
+                        const data = await response.json().catch(() => ({}));
+                        addDebugInfo(`Server processing error: ${data.error || response.status}`);
                     }
+                    lastRttRef.current = performance.now() - sentAt;
 
                     gameLoopRef.current = requestAnimationFrame(processFrame);
                 } catch (err) {
@@ -208,6 +338,127 @@ window.ElementsGame = (() => {
             };
 
             gameLoopRef.current = requestAnimationFrame(processFrame);
+        };
+
+        // Persistent stream: the server keeps only the newest unprocessed frame and
+        // acks each one, so we stop capturing while MAX_IN_FLIGHT frames are outstanding
+        const startSocketLoop = (attempt = 0) => {
+            const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+            const query = RENDER_MODE === 'state' ? '?mode=state&mask=1' : '?mode=image';
+            const socket = new WebSocket(`${protocol}://${window.location.host}/ws${query}`);
+            socket.binaryType = 'blob';
+            socketRef.current = socket;
+
+            let opened = false;
+            let rejected = false;
+            let inFlight = 0;
+            let capturing = false;
+            // Frames are numbered in send order, matching the server's seq
+            let sentCount = 0;
+            const sentAt = new Map();
+
+            const captureLoop = async () => {
+                if (!isMounted.current || socket.readyState !== WebSocket.OPEN) return;
+
+                if (!capturing && inFlight < MAX_IN_FLIGHT && videoRef.current && canvasRef.current) {
+                    capturing = true;
+                    try {
+                        const frameBlob = await captureFrame();
+                        if (frameBlob && socket.readyState === WebSocket.OPEN) {
+                            inFlight += 1;
+                            sentCount += 1;
+                            sentAt.set(sentCount, performance.now());
+                            socket.send(frameBlob);
+                        }
+                    } finally {
+                        capturing = false;
+                    }
+                }
+                gameLoopRef.current = requestAnimationFrame(captureLoop);
+            };
+
+            socket.onopen = () => {
+                opened = true;
+                addDebugInfo('Starting WebSocket game loop');
+                gameLoopRef.current = requestAnimationFrame(captureLoop);
+            };
+
+            socket.onmessage = async (event) => {
+                try {
+                    if (typeof event.data !== 'string') {
+                        // JPEG that follows an image-mode result
+                        await drawProcessedImage(event.data);
+                        return;
+                    }
+
+                    const message = JSON.parse(event.data);
+                    if (message.type === 'ack') {
+                        // A replaced frame will never get a result of its own
+                        if (message.replaced !== null) {
+                            inFlight = Math.max(0, inFlight - 1);
+                            sentAt.delete(message.replaced);
+                        }
+                    } else if (message.type === 'result') {
+                        inFlight = Math.max(0, inFlight - 1);
+                        if (sentAt.has(message.seq)) {
+                            const rtt = performance.now() - sentAt.get(message.seq);
+                            sentAt.delete(message.seq);
+                            socket.send(JSON.stringify({ type: 'stats', rtt }));
+                        }
+                        if (message.skipped) {
+                            return;
+                        }
+                        if (!message.success) {
+                            addDebugInfo(`Server processing error: ${message.error}`);
+                            return;
+                        }
+                        if (message.state) {
+                            await drawStateResult(message);
+                        }
+                        handleSoundEvents(message.sound_events);
+                        applyQuality(message.quality);
+                    } else if (message.type === 'rejected') {
+                        // Server at capacity; it closes the socket, so reconnect later
+                        rejected = true;
+                        addDebugInfo(`Server at capacity, retrying in ${message.retry_after}s`);
+                        setTimeout(() => {
+                            if (isMounted.current) startSocketLoop();
+                        }, message.retry_after * 1000);
+                    }
+                } catch (err) {
+                    addDebugInfo(`Frame processing error: ${err.message}`);
+                    console.error('Frame processing error:', err);
+                }
+            };
+
+            socket.onclose = () => {
+                socketRef.current = null;
+                if (!isMounted.current || rejected) return;
+                if (opened || attempt > 0) {
+                    // Server restart, worker recycle or network drop: reconnect with backoff
+                    const delay = Math.min(RECONNECT_MAX_MS, RECONNECT_BASE_MS * 2 ** (opened ? 0 : attempt));
+                    addDebugInfo(`WebSocket closed, reconnecting in ${delay / 1000}s`);
+                    setTimeout(() => {
+                        if (isMounted.current) startSocketLoop(opened ? 1 : attempt + 1);
+                    }, delay);
+                } else {
+                    addDebugInfo('WebSocket unavailable, falling back to HTTP');
+                    startHttpLoop();
+                }
+            };
+        };
+
+        const startGameLoop = React.useCallback(() => {
+            if (!videoRef.current || !canvasRef.current) {
+                addDebugInfo('Video or canvas ref not ready');
+                return;
+            }
+
+            if (USE_WEBSOCKET && 'WebSocket' in window) {
+                startSocketLoop();
+            } else {
+                startHttpLoop();
+            }
         }, [handleSoundEvents]);
 
         // Add a start button component
@@ -0,0 +1,16 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# The tests never run inference, so importing app must not build the MediaPipe pipelines
+os.environ.setdefault('MODEL_INIT', 'deferred')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def dead_pid():
+    # Pid of a process that has exited and been reaped, for files left behind by dead workers
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
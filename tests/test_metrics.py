@@ -0,0 +1,30 @@
+import json
+import os
+
+from metrics import Counter, Gauge, Histogram, MultiProcessCollector, Registry
+
+def worker_registry(frames, sessions, cold_start):
+    registry = Registry()
+    Counter('frames_total', 'Frames', ['mode'], registry=registry).inc(frames, mode='image')
+    Gauge('sessions', 'Sessions', registry=registry, function=lambda: sessions)
+    Gauge('cold_start_seconds', 'Cold start', registry=registry, function=lambda: cold_start, aggregate='max')
+    Histogram('latency_seconds', 'Latency', registry=registry, buckets=(0.1, 1.0)).observe(0.05)
+    return registry
+
+def write_worker(path, pid, registry):
+    with open(os.path.join(path, f'{pid}-1.json'), 'w') as f:
+        json.dump(registry.snapshot(), f)
+
+def test_workers_are_merged(tmp_path, dead_pid):
+    collector = MultiProcessCollector(str(tmp_path), registry=worker_registry(3, 2, 1.5), interval=60)
+    # Another live process and a recycled worker stand in for the rest of the pool
+    write_worker(str(tmp_path), os.getppid(), worker_registry(4, 5, 2.5))
+    write_worker(str(tmp_path), dead_pid, worker_registry(10, 7, 9.0))
+
+    text = collector.render()
+    assert 'frames_total{mode="image"} 17' in text
+    # Gauges only count live workers
+    assert 'sessions 7' in text
+    assert 'cold_start_seconds 2.5' in text
+    assert 'latency_seconds_bucket{le="0.1"} 3' in text
+    assert 'latency_seconds_count 3' in text
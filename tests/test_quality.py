@@ -0,0 +1,34 @@
+from app import QualityController
+
+LEVELS = [{'name': 'best'}, {'name': 'good'}, {'name': 'low'}, {'name': 'worst'}]
+
+def controller():
+    return QualityController(target_fps=15, enabled=True, levels=LEVELS, cooldown_frames=1)
+
+def run_frames(quality, frames, processing_ms, queue_ms=0, rtt_ms=None):
+    for _ in range(frames):
+        quality.observe_queue(queue_ms)
+        if rtt_ms is not None:
+            quality.observe_rtt(rtt_ms)
+        quality.observe_processing(processing_ms)
+        quality.update()
+
+def test_network_latency_does_not_lower_quality():
+    # A remote player on an idle server: 60 ms of network on top of 30 ms of processing
+    quality = controller()
+    run_frames(quality, 100, processing_ms=30, rtt_ms=90)
+    assert quality.level == 0
+    assert quality.report()['client_rtt_ms'] == 90
+
+def test_slow_frames_lower_quality_and_recover():
+    quality = controller()
+    run_frames(quality, 50, processing_ms=60, queue_ms=40)
+    assert quality.level == len(LEVELS) - 1
+    run_frames(quality, 50, processing_ms=20)
+    assert quality.level == 0
+
+def test_disabled_controller_keeps_the_best_level():
+    quality = controller()
+    quality.enabled = False
+    run_frames(quality, 50, processing_ms=200)
+    assert quality.level == 0
@@ -0,0 +1,35 @@
+import uuid
+
+import pytest
+
+import app
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+def frames_series():
+    return {key for key in app.FRAMES_TOTAL._values}
+
+@pytest.mark.parametrize('url', ['/process_frame_binary?mode=junk', '/process_frame_binary?mode='])
+def test_binary_route_rejects_unknown_modes(client, url):
+    before = frames_series()
+    response = client.post(url, data=b'\xff\xd8', content_type='image/jpeg')
+    assert response.status_code == 400
+    assert frames_series() == before
+
+def test_json_route_rejects_unknown_modes(client):
+    response = client.post('/process_frame', json={'frame': 'data:image/jpeg;base64,', 'mode': 'junk'})
+    assert response.status_code == 400
+
+def test_undecodable_upload_is_a_client_error(client):
+    response = client.post('/process_frame_binary', data=b'garbage', content_type='image/jpeg')
+    assert response.status_code == 400
+    assert response.get_json()['invalid_frame']
+
+def test_reset_does_not_create_a_session(client):
+    # Stored state makes the scheduler admit a session, so a reset must not be a way in
+    session_id = uuid.uuid4().hex
+    response = client.post('/reset_game', headers={'Cookie': f'{app.SESSION_COOKIE}={session_id}'})
+    assert response.get_json()['success']
+    assert not app.sessions.store.exists(session_id)
@@ -0,0 +1,178 @@
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from scheduler import FrameScheduler, FrameSkipped, SessionRejected
+
+def wait_until(predicate, timeout=5):
+    end = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > end:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+class Frame:
+    # Sends one frame through scheduler.slot() on its own thread, holding the slot until released
+    def __init__(self, scheduler, session_id, log, hold=True):
+        self.session_id = session_id
+        self.granted = threading.Event()
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+        self.outcome = None
+        self.thread = threading.Thread(target=self._run, args=(scheduler, log))
+        self.thread.start()
+
+    def _run(self, scheduler, log):
+        try:
+            with scheduler.slot(self.session_id):
+                log.append(self.session_id)
+                self.outcome = 'granted'
+                self.granted.set()
+                self.release.wait(5)
+        except FrameSkipped as e:
+            self.outcome = e.reason
+
+    def finish(self):
+        self.release.set()
+        self.thread.join(5)
+
+def test_one_running_frame_per_session():
+    scheduler = FrameScheduler(capacity=2, queue_depth=2, deadline_ms=5000)
+    log = []
+    first = Frame(scheduler, 'a', log)
+    assert first.granted.wait(5)
+    second = Frame(scheduler, 'a', log)
+    wait_until(lambda: scheduler.queued == 1)
+    # A free pipeline goes to another session rather than a second frame of 'a'
+    other = Frame(scheduler, 'b', log)
+    assert other.granted.wait(5)
+    assert not second.granted.is_set()
+    assert scheduler.running == 2
+
+    first.finish()
+    assert second.granted.wait(5)
+    second.finish()
+    other.finish()
+    assert log == ['a', 'b', 'a']
+
+def test_sessions_take_turns():
+    # Deep enough queues that the backlog below doesn't count as saturation
+    scheduler = FrameScheduler(capacity=1, queue_depth=3, deadline_ms=5000)
+    log = []
+    blocker = Frame(scheduler, 'x', log)
+    assert blocker.granted.wait(5)
+    frames = []
+    for session_id in ['a', 'a', 'b']:
+        frames.append(Frame(scheduler, session_id, log, hold=False))
+        wait_until(lambda: scheduler.queued == len(frames))
+
+    blocker.finish()
+    for frame in frames:
+        frame.thread.join(5)
+    assert log == ['x', 'a', 'b', 'a']
+    assert [frame.outcome for frame in frames] == ['granted'] * 3
+
+def test_sending_more_frames_at_once_does_not_buy_a_bigger_share():
+    # 'a' keeps three requests in flight, 'b' and 'c' one each, as a polite client would
+    scheduler = FrameScheduler(capacity=1, queue_depth=4, deadline_ms=5000)
+    grants = Counter()
+    end = time.monotonic() + 1
+
+    def client(session_id):
+        while time.monotonic() < end:
+            with scheduler.slot(session_id):
+                grants[session_id] += 1
+                time.sleep(0.005)
+
+    threads = [threading.Thread(target=client, args=(session_id,)) for session_id in ['a', 'a', 'a', 'b', 'c']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert min(grants.values()) / max(grants.values()) > 0.8, grants
+
+def test_newer_frame_replaces_the_oldest_queued_one():
+    scheduler = FrameScheduler(capacity=1, queue_depth=1, deadline_ms=5000)
+    log = []
+    blocker = Frame(scheduler, 'x', log)
+    assert blocker.granted.wait(5)
+    old = Frame(scheduler, 'a', log, hold=False)
+    wait_until(lambda: scheduler.queued == 1)
+    new = Frame(scheduler, 'a', log, hold=False)
+    old.thread.join(5)
+    assert old.outcome == 'replaced'
+
+    blocker.finish()
+    new.thread.join(5)
+    assert new.outcome == 'granted'
+    assert log == ['x', 'a']
+
+def test_frame_past_its_deadline_is_skipped():
+    scheduler = FrameScheduler(capacity=1, queue_depth=2, deadline_ms=50)
+    log = []
+    blocker = Frame(scheduler, 'x', log)
+    assert blocker.granted.wait(5)
+    late = Frame(scheduler, 'a', log, hold=False)
+    late.thread.join(5)
+    assert late.outcome == 'deadline'
+    assert scheduler.queued == 0
+
+    # The expired frame left no trace, the session's next frame runs normally
+    blocker.finish()
+    following = Frame(scheduler, 'a', log, hold=False)
+    following.thread.join(5)
+    assert following.outcome == 'granted'
+    assert scheduler.running == 0
+
+def test_new_sessions_are_rejected_at_capacity():
+    scheduler = FrameScheduler(capacity=1, deadline_ms=5000, max_active_sessions=2, active_window=60)
+    for session_id in ['a', 'b']:
+        with scheduler.slot(session_id):
+            pass
+    with pytest.raises(SessionRejected):
+        with scheduler.slot('c'):
+            pass
+    # Sessions that are already playing keep being served
+    with scheduler.slot('a'):
+        pass
+    assert scheduler.active_sessions == 2
+
+def test_sessions_playing_on_another_worker_are_admitted():
+    # Each worker's scheduler only sees its own sessions; the shared store knows the rest
+    stored = {'b'}
+    scheduler = FrameScheduler(capacity=1, deadline_ms=5000, max_active_sessions=1,
+                               known_session=lambda session_id: session_id in stored)
+    with scheduler.slot('a'):
+        pass
+    with pytest.raises(SessionRejected):
+        scheduler.admit('c')
+    with scheduler.slot('b'):
+        pass
+    assert scheduler.active_sessions == 2
+
+def test_idle_sessions_free_their_place():
+    scheduler = FrameScheduler(capacity=1, deadline_ms=5000, max_active_sessions=1, active_window=0.05)
+    with scheduler.slot('a'):
+        pass
+    with pytest.raises(SessionRejected):
+        scheduler.admit('b')
+    time.sleep(0.1)
+    scheduler.admit('b')
+
+def test_new_sessions_are_rejected_while_the_backlog_is_full():
+    scheduler = FrameScheduler(capacity=1, queue_depth=2, deadline_ms=5000)
+    log = []
+    blocker = Frame(scheduler, 'x', log)
+    assert blocker.granted.wait(5)
+    queued = [Frame(scheduler, 'a', log, hold=False) for _ in range(2)]
+    wait_until(lambda: scheduler.queued == 2)
+    with pytest.raises(SessionRejected):
+        scheduler.admit('b')
+
+    blocker.finish()
+    for frame in queued:
+        frame.thread.join(5)
+    scheduler.admit('b')
@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+import app
+import state_store
+from state_store import InProcessStore, LocalRedis, RedisStore, SharedMemoryStore
+
+@pytest.fixture(params=['memory', 'redis', 'shm'])
+def store_factory(request, tmp_path):
+    # Returns a factory so each "worker" gets its own store object over the same backend
+    if request.param == 'memory':
+        store = InProcessStore()
+        return lambda: store
+    if request.param == 'redis':
+        client = LocalRedis()
+        return lambda: RedisStore(client)
+    return lambda: SharedMemoryStore(str(tmp_path))
+
+def test_save_load_delete(store_factory):
+    store = store_factory()
+    assert store.load('a') is None
+    store.save('a', {'value': 1}, ttl=60)
+    assert store_factory().load('a') == {'value': 1}
+    store.delete('a')
+    assert store.load('a') is None
+
+def test_expired_state_is_dropped(store_factory, monkeypatch):
+    store = store_factory()
+    store.save('a', {'value': 1}, ttl=5)
+    assert store.exists('a')
+    now = time.time()
+    monkeypatch.setattr(state_store.time, 'time', lambda: now + 10)
+    assert store.load('a') is None
+    assert not store.exists('a')
+
+def test_sweep_removes_expired_files(tmp_path, monkeypatch):
+    store = SharedMemoryStore(str(tmp_path))
+    store.save('old', {}, ttl=5)
+    store.save('new', {}, ttl=600)
+    with store.lock('old'):
+        pass
+    now = time.time()
+    # Lock files are only swept once they are a minute old
+    monkeypatch.setattr(state_store.time, 'time', lambda: now + 120)
+    store.sweep()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['new.json']
+
+def test_lock_is_exclusive(store_factory):
+    first, second = store_factory(), store_factory()
+    acquired = threading.Event()
+
+    def contend():
+        with second.lock('a'):
+            acquired.set()
+
+    with first.lock('a'):
+        thread = threading.Thread(target=contend)
+        thread.start()
+        assert not acquired.wait(0.2)
+    assert acquired.wait(5)
+    thread.join()
+
+def test_session_state_moves_between_workers(store_factory):
+    # Two managers over one backend stand in for two worker processes
+    first = app.SessionManager(app.pipeline_pool, store_factory())
+    second = app.SessionManager(app.pipeline_pool, store_factory())
+
+    with first.session('player') as game:
+        fire = next(iter(game.squares))
+        game.word_positions[fire] = (123, 45)
+        game.grabbed_word = fire
+        game.mask_color = game.squares[fire]['color']
+        game.gold_box['color'] = (255, 215, 0)
+        game.finger_in_box[fire] = True
+        game.last_sound_time['Eureka.wav'] = 12.5
+        saved = game.to_state()
+
+    with second.session('player') as game:
+        assert game.to_state() == saved
+        game.grabbed_word = None
+        game.word_positions[fire] = (10, 20)
+
+    # And back again, so the first worker's local copy doesn't win over the store
+    with first.session('player') as game:
+        assert game.grabbed_word is None
+        assert game.word_positions[fire] == (10, 20)
+        assert game.mask_color == tuple(saved['mask_color'])
+
+def test_sessions_do_not_share_state(store_factory):
+    manager = app.SessionManager(app.pipeline_pool, store_factory())
+    with manager.session('a') as game:
+        game.grabbed_word = next(iter(game.squares))
+    with manager.session('b') as game:
+        assert game.grabbed_word is None
+
+def test_in_process_sweep_drops_expired_states_and_locks(monkeypatch):
+    store = InProcessStore()
+    store.save('old', {}, ttl=5)
+    store.save('new', {}, ttl=600)
+    for session_id in ('old', 'new', 'never-saved'):
+        with store.lock(session_id):
+            pass
+    now = time.time()
+    monkeypatch.setattr(state_store.time, 'time', lambda: now + 120)
+    store.sweep()
+    assert list(store._states) == ['new']
+    assert list(store._locks) == ['new']
@@ -0,0 +1,33 @@
+import os
+
+from worker_status import WorkerStatusBoard
+
+def test_ready_only_when_every_worker_is_ready(tmp_path):
+    board = WorkerStatusBoard(str(tmp_path), expected_workers=2)
+    board.publish({'ready': True, 'cold_start_seconds': 1.5})
+    # The second worker has not reported in yet
+    assert not board.summary()['ready']
+
+    # Another live process stands in for the second worker
+    other = os.getppid()
+    (tmp_path / f'{other}.json').write_text('{"ready": false}')
+    summary = board.summary()
+    assert not summary['ready']
+    assert summary['workers_live'] == 2 and summary['workers_ready'] == 1
+
+    (tmp_path / f'{other}.json').write_text('{"ready": true, "cold_start_seconds": 2.0}')
+    summary = board.summary()
+    assert summary['ready']
+    assert summary['workers'][str(os.getpid())]['cold_start_seconds'] == 1.5
+
+def test_dead_workers_are_dropped(tmp_path, dead_pid):
+    board = WorkerStatusBoard(str(tmp_path), expected_workers=1)
+    (tmp_path / f'{dead_pid}.json').write_text('{"ready": true}')
+    assert not board.summary()['ready']
+    assert not (tmp_path / f'{dead_pid}.json').exists()
+
+def test_single_process_reports_its_own_status():
+    board = WorkerStatusBoard()
+    assert not board.summary()['ready']
+    board.publish({'ready': True})
+    assert board.summary()['ready']
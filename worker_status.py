@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to another user
+        return True
+    return True
+
+class WorkerStatusBoard:
+    # One JSON file per worker process, named by pid, so any worker can answer for all of them.
+    # Without a directory (a single process) only this process's own status is reported.
+    def __init__(self, path=None, expected_workers=1):
+        self.path = path
+        self.expected_workers = max(1, expected_workers)
+        self._local = None
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def _file(self, pid):
+        return os.path.join(self.path, f'{pid}.json')
+
+    def publish(self, status):
+        # The pid is read on every call: under gunicorn --preload the board is created in the master
+        self._local = status
+        if not self.path:
+            return
+        temporary = self._file(os.getpid()) + '.tmp'
+        try:
+            with open(temporary, 'w') as f:
+                json.dump(status, f)
+            os.replace(temporary, self._file(os.getpid()))
+        except OSError as e:
+            logger.warning(f"Could not publish worker status: {e}")
+
+    def remove(self, pid):
+        if self.path:
+            try:
+                os.remove(self._file(pid))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        if self.path:
+            for name in os.listdir(self.path):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+
+    def workers(self):
+        # Statuses of the live workers by pid; files left behind by dead workers are removed
+        if not self.path:
+            return {os.getpid(): self._local} if self._local is not None else {}
+        statuses = {}
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'):
+                continue
+            pid = int(name[:-len('.json')])
+            if not pid_alive(pid):
+                self.remove(pid)
+                continue
+            try:
+                with open(os.path.join(self.path, name)) as f:
+                    statuses[pid] = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+        return statuses
+
+    def summary(self):
+        # Ready only once every expected worker has reported in and all of them are warm
+        workers = self.workers()
+        ready = [pid for pid, status in workers.items() if status.get('ready')]
+        return {
+            'ready': len(workers) >= self.expected_workers and len(ready) == len(workers),
+            'workers_expected': self.expected_workers,
+            'workers_live': len(workers),
+            'workers_ready': len(ready),
+            'workers': {str(pid): status for pid, status in sorted(workers.items())}
+        }